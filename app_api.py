@@ -1,284 +1,3090 @@
 import streamlit as st
-import pandas as pd
+from streamlit.errors import StreamlitAPIException
 import sqlite3
-import requests
 import json
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import csv
 import datetime
+import functools
+import hashlib
+import hmac
+import http.server
+import importlib
+import inspect
+import io
 import os
+import queue
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
 # from dotenv import load_dotenv
 
+class _LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# Heavy dependencies are only imported by the pages and calls that use them,
+# which keeps them out of the cold start of every other page
+pd = _LazyModule("pandas")
+np = _LazyModule("numpy")
+requests = _LazyModule("requests")
+
 # Load environment variables
 # load_dotenv()
 
-# Read the Gemini API key from environment variable
-def get_api_key():
+# Read the Gemini API key from environment variable
+def get_api_key():
+    """
+    Retrieve Gemini API key from Streamlit secrets or fallback methods.
+    """
+    # Retrieve from secrets, ensuring it's a clean string
+    try:
+        api_key = st.secrets["gemini"] if "gemini" in st.secrets else None
+    except Exception as e:
+        st.error(f"Error retrieving API key from secrets: {e}")
+        api_key = None
+    
+    # # User input fallback
+    # if not api_key:
+    #     api_key = st.text_input("Enter your Gemini API Key", type="password")
+    
+    return api_key
+
+
+# Gemini API endpoint
+API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent"
+GENERATION_CONFIG = {"temperature": 0.7, "maxOutputTokens": 1024}
+
+# Questionnaire; answers are stored under the keys Q1..Qn in this order
+QUESTIONS = [
+    {
+        "question": "Should autonomous vehicles prioritize saving passengers over pedestrians, or should every life be treated equally?",
+        "input_type": "selectbox",
+        "options": ["Prioritize Passengers", "Treat Every Life Equally", "Prioritize Pedestrians"]
+    },
+    {
+        "question": "In a situation where only one life can be saved, should age (e.g., child vs. elderly) influence the decision?",
+        "input_type": "selectbox",
+        "options": ["Yes, prioritize the younger", "No, every life is equal", "Not Sure"]
+    },
+    {
+        "question": "How should autonomous vehicles handle situations involving animals on the road? Should they prioritize human safety over animal lives?",
+        "input_type": "text_area"
+    },
+    {
+        "question": "Would you feel comfortable knowing an autonomous vehicle might sacrifice your safety to save a larger group of people?",
+        "input_type": "radio",
+        "options": ["Yes", "No", "Maybe"]
+    },
+    {
+        "question": "What ethical principles should guide the decisions of autonomous vehicles during accidents?",
+        "input_type": "text_area"
+    },
+    {
+        "question": "Should autonomous vehicles be programmed to follow traffic rules strictly, even if it means a higher risk of accidents?",
+        "input_type": "radio",
+        "options": ["Yes", "No", "Depends on the situation"]
+    },
+]
+
+# Free-text answers can't be counted, so they are sampled instead
+FREE_TEXT_QUESTIONS = tuple(
+    f"Q{idx}" for idx, item in enumerate(QUESTIONS, 1) if item["input_type"] == "text_area"
+)
+
+# Read a setting from Streamlit secrets, falling back to DTL_<NAME> environment variables
+def get_setting(name, default=None):
+    """
+    Look up a configuration value in Streamlit secrets or the environment.
+    """
+    try:
+        if name in st.secrets:
+            return st.secrets[name]
+    except Exception:
+        pass
+    return os.environ.get(f"DTL_{name.upper()}", default)
+
+def get_db_path():
+    return get_setting("db_path", "dtl_data.db")
+
+# Hot-path instrumentation. Functions decorated with @instrumented record their call
+# count, errors, a latency histogram and result sizes in a process-wide registry, and
+# calls slower than their kind's threshold go to a bounded slow-call log. Recording is
+# a few counter updates under a lock, cheap enough to leave on all the time.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SLOW_CALL_THRESHOLDS_MS = {
+    # kind: (setting, default)
+    "db": ("slow_query_ms", 100),
+    "llm": ("slow_llm_ms", 15000),
+    "render": ("slow_render_ms", 500),
+}
+SLOW_LOG_SIZE = 200
+
+class Metrics:
+    """
+    Latency histograms, totals and a slow-call log for instrumented calls.
+    """
+
+    def __init__(self, slow_thresholds):
+        self.slow_thresholds = slow_thresholds
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.slow = collections.deque(maxlen=SLOW_LOG_SIZE)
+
+    def observe(self, kind, name, seconds, error=False, detail=None, **totals):
+        """
+        Record one call. `totals` are added to the call's running totals,
+        e.g. rows=10 or prompt_chars=2000.
+        """
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            stats = self.calls.get((kind, name))
+            if stats is None:
+                stats = self.calls[kind, name] = {
+                    "count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0,
+                    "buckets": [0] * (len(LATENCY_BUCKETS) + 1), "totals": {},
+                }
+            stats["count"] += 1
+            stats["errors"] += error
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["buckets"][bucket] += 1
+            for key, value in totals.items():
+                if value is not None:
+                    stats["totals"][key] = stats["totals"].get(key, 0) + value
+            if seconds * 1000 >= self.slow_thresholds.get(kind, float("inf")):
+                self.slow.append({
+                    "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "kind": kind,
+                    "name": name,
+                    "ms": round(seconds * 1000, 1),
+                    "error": error,
+                    "detail": detail,
+                })
+
+    def snapshot(self):
+        """
+        Return ({(kind, name): stats}, [slow calls, oldest first]) as copies.
+        """
+        with self.lock:
+            calls = {
+                key: {**stats, "buckets": list(stats["buckets"]), "totals": dict(stats["totals"])}
+                for key, stats in self.calls.items()
+            }
+            return calls, list(self.slow)
+
+@st.cache_resource
+def get_metrics():
+    return Metrics({
+        kind: float(get_setting(setting, default))
+        for kind, (setting, default) in SLOW_CALL_THRESHOLDS_MS.items()
+    })
+
+def _call_detail(signature, log_args, args, kwargs):
+    # Short description of a slow call for the log. Only allow-listed arguments are
+    # shown; the others may hold secrets or personal data.
+    if not log_args:
+        return None
+    try:
+        bound = signature.bind(*args, **kwargs).arguments
+    except TypeError:
+        return None
+    detail = ", ".join(f"{name}={bound[name]!r}" for name in log_args if name in bound)
+    return detail if len(detail) <= 120 else detail[:117] + "..."
+
+def instrumented(kind, rows=None, log_args=()):
+    """
+    Decorator timing every call of a DB ("db"), LLM ("llm") or page ("render") function.
+    rows(result), if given, returns the number of rows the call produced. log_args names
+    the arguments that may be shown in the slow-call log; by default none are.
+    Don't instrument functions that take secrets such as API keys.
+    """
+    def decorate(func):
+        name = func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                elapsed = time.perf_counter() - started
+                detail = _call_detail(signature, log_args, args, kwargs)
+                get_metrics().observe(kind, name, elapsed, error=True, detail=detail)
+                raise
+            elapsed = time.perf_counter() - started
+            metrics = get_metrics()
+            detail = None
+            if elapsed * 1000 >= metrics.slow_thresholds.get(kind, float("inf")):
+                detail = _call_detail(signature, log_args, args, kwargs)
+            metrics.observe(kind, name, elapsed, detail=detail, rows=rows(result) if rows else None)
+            return result
+        return wrapper
+    return decorate
+
+# SQLite tuning for the pooled connections
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_STATEMENT_CACHE_SIZE = 256
+SQLITE_POOL_SIZE = 8  # idle connections kept per database
+
+class ConnectionPool:
+    """
+    Tuned connections to one database, shared by every thread and session.
+    Each call checks a connection out for as long as it needs it; Streamlit runs every
+    rerun on a new thread, so connections can't be tied to threads.
+    """
+
+    def __init__(self, db_path, max_idle=SQLITE_POOL_SIZE):
+        self.db_path = db_path
+        self.opened = 0
+        # Most recently used first, so busy connections keep their statement caches warm
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+            cached_statements=SQLITE_STATEMENT_CACHE_SIZE,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self.opened += 1
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            # Never wait for one: calls that nest checkouts would deadlock
+            conn = self._open()
+        try:
+            yield conn
+        finally:
+            # Don't hand a half-done transaction to the next caller
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+@st.cache_resource
+def get_connection_pool(db_path):
+    return ConnectionPool(db_path, int(get_setting("sqlite_pool_size", SQLITE_POOL_SIZE)))
+
+def connection(db_path=None):
+    """
+    Check out a connection to the app database for a with-block:
+
+        with connection() as conn:
+            ...
+
+    Connections run in WAL mode so readers don't block the writer, wait on locks
+    instead of failing with "database is locked", and keep a prepared statement cache.
+    """
+    return get_connection_pool(db_path or get_db_path()).connection()
+
+# Schema migrations. MIGRATIONS[n] upgrades a database from version n to n + 1;
+# the current version is kept in PRAGMA user_version. Migrations are append-only:
+# never edit one once a later one exists. Each carries its own SQL and data rather
+# than calling application code, so it replays the same on old databases however
+# that code and the questionnaire change later.
+def _create_base_schema(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            age INTEGER,
+            gender TEXT,
+            knows_autonomous TEXT,
+            timestamp TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            question TEXT,
+            response TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            content TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            post_id INTEGER,
+            user_id INTEGER,
+            parent_comment_id INTEGER,
+            content TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(post_id) REFERENCES posts(id),
+            FOREIGN KEY(user_id) REFERENCES users(id),
+            FOREIGN KEY(parent_comment_id) REFERENCES comments(id)
+        )
+    ''')
+    # Add regulations table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS regulations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            content TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _add_hot_path_indexes(cursor):
+    # Forum: posts newest first, comments per post in order
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_posts_created_at ON posts (created_at, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_comments_post_id ON comments (post_id, created_at)")
+    # Questionnaire and regulation reads
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_responses_user_id ON responses (user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_regulations_created_at ON regulations (created_at)")
+
+def _add_response_aggregates(cursor):
+    # Per-question option counts, overall and broken down by respondent demographics
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS response_stats (
+            question TEXT NOT NULL,
+            option TEXT NOT NULL,
+            dimension TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (question, option, dimension, bucket)
+        ) WITHOUT ROWID
+    """)
+    # Fixed-size reservoir sample of the free-text answers to each question
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS response_samples (
+            question TEXT NOT NULL,
+            slot INTEGER NOT NULL,
+            response_id INTEGER,
+            response TEXT,
+            PRIMARY KEY (question, slot)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS response_sample_counts (
+            question TEXT PRIMARY KEY,
+            seen INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # Backfill from the existing answers. The logic is kept here rather than shared
+    # with the application code, so replaying this migration on an old database gives
+    # the same result later on: each user counts once as a respondent, every choice
+    # answer is counted and the free-text answers to Q3 and Q5 are sampled.
+    cursor.execute("""
+        WITH answers AS (
+            SELECT r.user_id, r.question, r.response,
+                   CASE
+                       WHEN u.age IS NULL THEN 'unknown'
+                       WHEN u.age < 18 THEN '<18'
+                       WHEN u.age < 25 THEN '18-24'
+                       WHEN u.age < 35 THEN '25-34'
+                       WHEN u.age < 45 THEN '35-44'
+                       WHEN u.age < 55 THEN '45-54'
+                       WHEN u.age < 65 THEN '55-64'
+                       ELSE '65+'
+                   END AS age_band,
+                   COALESCE(NULLIF(u.gender, ''), 'unknown') AS gender,
+                   COALESCE(NULLIF(u.knows_autonomous, ''), 'unknown') AS knows_autonomous
+            FROM responses r
+            LEFT JOIN users u ON u.id = r.user_id
+        ),
+        counted AS (
+            SELECT question, response AS option, age_band, gender, knows_autonomous
+            FROM answers
+            WHERE question NOT IN ('Q3', 'Q5')
+            UNION ALL
+            SELECT '*', '', age_band, gender, knows_autonomous
+            FROM answers
+            GROUP BY user_id
+        )
+        INSERT INTO response_stats (question, option, dimension, bucket, count)
+        SELECT question, option, dimension, bucket, COUNT(*) FROM (
+            SELECT question, option, 'all' AS dimension, '' AS bucket FROM counted
+            UNION ALL SELECT question, option, 'age_band', age_band FROM counted
+            UNION ALL SELECT question, option, 'gender', gender FROM counted
+            UNION ALL SELECT question, option, 'knows_autonomous', knows_autonomous FROM counted
+        )
+        GROUP BY question, option, dimension, bucket
+    """)
+    cursor.execute("""
+        CREATE TEMP TABLE free_text_answers AS
+        SELECT id, question, TRIM(response, ' ' || char(9, 10, 13)) AS response
+        FROM responses
+        WHERE question IN ('Q3', 'Q5') AND TRIM(response, ' ' || char(9, 10, 13)) != ''
+    """)
+    cursor.execute("""
+        INSERT INTO response_sample_counts (question, seen)
+        SELECT question, COUNT(*) FROM free_text_answers GROUP BY question
+    """)
+    # A uniform random sample of up to 20 answers per question, 500 characters each
+    cursor.execute("""
+        INSERT INTO response_samples (question, slot, response_id, response)
+        SELECT question, slot - 1, id, SUBSTR(response, 1, 500) FROM (
+            SELECT question, id, response,
+                   ROW_NUMBER() OVER (PARTITION BY question ORDER BY RANDOM()) AS slot
+            FROM free_text_answers
+        )
+        WHERE slot <= 20
+    """)
+    cursor.execute("DROP TABLE free_text_answers")
+
+def _add_response_summaries(cursor):
+    # LLM summaries of consecutive free-text answers (by response id) to one question
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS response_summaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question TEXT NOT NULL,
+            first_response_id INTEGER NOT NULL,
+            last_response_id INTEGER NOT NULL,
+            response_count INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_response_summaries_question ON response_summaries (question, last_response_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_responses_question ON responses (question, id)")
+
+def _add_regulation_input_hash(cursor):
+    # Fingerprint of the data and model settings each regulation was generated from
+    cursor.execute("ALTER TABLE regulations ADD COLUMN input_hash TEXT")
+    cursor.execute("ALTER TABLE regulations ADD COLUMN model TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_regulations_input_hash ON regulations (input_hash)")
+
+def _add_regulation_jobs(cursor):
+    # Background regulation generation requests; times are Unix seconds
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS regulation_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            input_hash TEXT NOT NULL,
+            force INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            regulation_id INTEGER,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            FOREIGN KEY(regulation_id) REFERENCES regulations(id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_regulation_jobs_status ON regulation_jobs (status, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_regulation_jobs_input_hash ON regulation_jobs (input_hash, status)")
+
+def _add_question_catalog(cursor):
+    # Questions and their choice options. Ids are never reused or renumbered, so stored
+    # codes keep their meaning when the questionnaire changes.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY,
+            key TEXT NOT NULL UNIQUE,
+            text TEXT NOT NULL,
+            input_type TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS options (
+            id INTEGER PRIMARY KEY,
+            question_id INTEGER NOT NULL,
+            label TEXT NOT NULL,
+            UNIQUE (question_id, label),
+            FOREIGN KEY(question_id) REFERENCES questions(id)
+        )
+    """)
+    # The questionnaire as it was when answers were first coded; sync_question_catalog
+    # adds later questions and options at startup
+    questionnaire = [
+        ("Q1", "Should autonomous vehicles prioritize saving passengers over pedestrians, or should every life be treated equally?",
+         "selectbox", ["Prioritize Passengers", "Treat Every Life Equally", "Prioritize Pedestrians"]),
+        ("Q2", "In a situation where only one life can be saved, should age (e.g., child vs. elderly) influence the decision?",
+         "selectbox", ["Yes, prioritize the younger", "No, every life is equal", "Not Sure"]),
+        ("Q3", "How should autonomous vehicles handle situations involving animals on the road? Should they prioritize human safety over animal lives?",
+         "text_area", []),
+        ("Q4", "Would you feel comfortable knowing an autonomous vehicle might sacrifice your safety to save a larger group of people?",
+         "radio", ["Yes", "No", "Maybe"]),
+        ("Q5", "What ethical principles should guide the decisions of autonomous vehicles during accidents?",
+         "text_area", []),
+        ("Q6", "Should autonomous vehicles be programmed to follow traffic rules strictly, even if it means a higher risk of accidents?",
+         "radio", ["Yes", "No", "Depends on the situation"]),
+    ]
+    for key, text, input_type, options in questionnaire:
+        question_id = cursor.execute(
+            "INSERT INTO questions (key, text, input_type) VALUES (?, ?, ?)", (key, text, input_type)
+        ).lastrowid
+        cursor.executemany(
+            "INSERT INTO options (question_id, label) VALUES (?, ?)", [(question_id, label) for label in options]
+        )
+    # Keep answers to questions or options no longer in QUESTIONS
+    cursor.execute("""
+        INSERT INTO questions (key, text, input_type)
+        SELECT DISTINCT question, question, 'text_area' FROM responses
+        WHERE question IS NOT NULL AND question NOT IN (SELECT key FROM questions)
+    """)
+    cursor.execute("""
+        INSERT INTO options (question_id, label)
+        SELECT DISTINCT q.id, r.response
+        FROM responses r
+        JOIN questions q ON q.key = r.question
+        WHERE q.input_type != 'text_area' AND r.response IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM options o WHERE o.question_id = q.id AND o.label = r.response)
+    """)
+
+    # Rewrite responses with integer question and option codes; only free-text
+    # answers keep their text
+    cursor.execute("""
+        CREATE TABLE responses_coded (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            question_id INTEGER NOT NULL,
+            option_id INTEGER,
+            response TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (question_id) REFERENCES questions (id),
+            FOREIGN KEY (option_id) REFERENCES options (id)
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO responses_coded (id, user_id, question_id, option_id, response)
+        SELECT r.id, r.user_id, q.id, o.id, CASE WHEN o.id IS NULL THEN r.response END
+        FROM responses r
+        JOIN questions q ON q.key = r.question
+        LEFT JOIN options o ON o.question_id = q.id AND o.label = r.response
+    """)
+    cursor.execute("DROP TABLE responses")
+    cursor.execute("ALTER TABLE responses_coded RENAME TO responses")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_responses_user_id ON responses (user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_responses_question ON responses (question_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_responses_option ON responses (question_id, option_id, user_id)")
+
+    # Option counts are keyed by the same codes
+    cursor.execute("DROP TABLE response_stats")
+    cursor.execute("""
+        CREATE TABLE response_stats (
+            question_id INTEGER NOT NULL,
+            option_id INTEGER NOT NULL,
+            dimension TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (question_id, option_id, dimension, bucket)
+        ) WITHOUT ROWID
+    """)
+    # Recount them from the coded answers: each user once as a respondent (code 0, 0)
+    # and every choice answer. The free-text samples are keyed by question key and
+    # stay as they are.
+    cursor.execute("""
+        WITH answers AS (
+            SELECT r.user_id, r.question_id, r.option_id,
+                   CASE
+                       WHEN u.age IS NULL THEN 'unknown'
+                       WHEN u.age < 18 THEN '<18'
+                       WHEN u.age < 25 THEN '18-24'
+                       WHEN u.age < 35 THEN '25-34'
+                       WHEN u.age < 45 THEN '35-44'
+                       WHEN u.age < 55 THEN '45-54'
+                       WHEN u.age < 65 THEN '55-64'
+                       ELSE '65+'
+                   END AS age_band,
+                   COALESCE(NULLIF(u.gender, ''), 'unknown') AS gender,
+                   COALESCE(NULLIF(u.knows_autonomous, ''), 'unknown') AS knows_autonomous
+            FROM responses r
+            LEFT JOIN users u ON u.id = r.user_id
+        ),
+        counted AS (
+            SELECT question_id, option_id, age_band, gender, knows_autonomous
+            FROM answers
+            WHERE option_id IS NOT NULL
+            UNION ALL
+            SELECT 0, 0, age_band, gender, knows_autonomous
+            FROM answers
+            GROUP BY user_id
+        )
+        INSERT INTO response_stats (question_id, option_id, dimension, bucket, count)
+        SELECT question_id, option_id, dimension, bucket, COUNT(*) FROM (
+            SELECT question_id, option_id, 'all' AS dimension, '' AS bucket FROM counted
+            UNION ALL SELECT question_id, option_id, 'age_band', age_band FROM counted
+            UNION ALL SELECT question_id, option_id, 'gender', gender FROM counted
+            UNION ALL SELECT question_id, option_id, 'knows_autonomous', knows_autonomous FROM counted
+        )
+        GROUP BY question_id, option_id, dimension, bucket
+    """)
+
+def _add_forum_search(cursor):
+    # Full-text indexes over post and comment text. They are external-content tables:
+    # the text lives only in posts/comments and triggers keep the indexes in step.
+    for table in ("posts", "comments"):
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+                content, content='{table}', content_rowid='id', tokenize='porter unicode61'
+            )
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {table}_fts (rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {table}_fts ({table}_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF content ON {table} BEGIN
+                INSERT INTO {table}_fts ({table}_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                INSERT INTO {table}_fts (rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+        # Index the existing rows in one pass
+        cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+def _add_job_heartbeats(cursor):
+    # Running jobs record when they last made progress, so only dead ones are requeued
+    cursor.execute("ALTER TABLE regulation_jobs ADD COLUMN heartbeat_at REAL")
+    # A requeued job may have stored the same summaries again; keep the first copy
+    cursor.execute("""
+        DELETE FROM response_summaries WHERE id NOT IN (
+            SELECT MIN(id) FROM response_summaries
+            GROUP BY question, first_response_id, last_response_id
+        )
+    """)
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_response_summaries_range
+        ON response_summaries (question, first_response_id, last_response_id)
+    """)
+
+MIGRATIONS = [
+    _create_base_schema,
+    _add_hot_path_indexes,
+    _add_response_aggregates,
+    _add_response_summaries,
+    _add_regulation_input_hash,
+    _add_regulation_jobs,
+    _add_question_catalog,
+    _add_forum_search,
+    _add_job_heartbeats,
+]
+
+def migrate(conn):
+    """
+    Apply any pending migrations, each in its own transaction.
+    Returns the resulting schema version.
+    """
+    while True:
+        cursor = conn.cursor()
+        # Take the write lock before reading the version so concurrent processes
+        # never apply the same migration twice
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.commit()
+                return version
+            MIGRATIONS[version](cursor)
+            cursor.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+# Queries that run on every page load; none of them may fall back to a full table scan
+# Forum posts are paged newest first with a (created_at, id) keyset cursor
+FORUM_POSTS_SQL = """
+    SELECT posts.id, users.name, posts.content, posts.created_at,
+           (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id) AS comment_count
+    FROM posts
+    JOIN users ON posts.user_id = users.id
+    ORDER BY posts.created_at DESC, posts.id DESC
+    LIMIT ?
+"""
+FORUM_POSTS_BEFORE_SQL = """
+    SELECT posts.id, users.name, posts.content, posts.created_at,
+           (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id) AS comment_count
+    FROM posts
+    JOIN users ON posts.user_id = users.id
+    WHERE (posts.created_at, posts.id) < (?, ?)
+    ORDER BY posts.created_at DESC, posts.id DESC
+    LIMIT ?
+"""
+POST_COMMENTS_SQL = """
+    SELECT comments.id, comments.post_id, comments.user_id, comments.content, comments.created_at,
+           comments.parent_comment_id, users.name
+    FROM comments
+    JOIN users ON comments.user_id = users.id
+    WHERE comments.post_id = ?
+    ORDER BY comments.created_at ASC
+"""
+# Ids go in as one JSON array so the statement text (and its cached plan)
+# is the same for every page size and never hits the bound-parameter limit
+FORUM_COMMENTS_SQL = """
+    SELECT comments.id, comments.post_id, comments.user_id, comments.content, comments.created_at,
+           comments.parent_comment_id, users.name
+    FROM comments
+    JOIN users ON comments.user_id = users.id
+    WHERE comments.post_id IN (SELECT value FROM json_each(?))
+    ORDER BY comments.post_id, comments.created_at ASC
+"""
+RECENT_REGULATIONS_SQL = "SELECT content, created_at FROM regulations ORDER BY created_at DESC LIMIT ?"
+USER_RESPONSES_SQL = """
+    SELECT questions.key, COALESCE(options.label, responses.response)
+    FROM responses
+    JOIN questions ON questions.id = responses.question_id
+    LEFT JOIN options ON options.id = responses.option_id
+    WHERE responses.user_id = ?
+"""
+
+# Ranked full-text search over posts and comments; `?` markers wrap the matched terms
+FORUM_SEARCH_SQL = """
+    SELECT kind, post_id, id, author, snippet, created_at FROM (
+        SELECT 'post' AS kind, posts.id AS post_id, posts.id AS id, users.name AS author,
+               snippet(posts_fts, 0, ?, ?, '...', 16) AS snippet, posts.created_at AS created_at,
+               bm25(posts_fts) AS rank
+        FROM posts_fts
+        JOIN posts ON posts.id = posts_fts.rowid
+        JOIN users ON users.id = posts.user_id
+        WHERE posts_fts MATCH ?
+        UNION ALL
+        SELECT 'comment', comments.post_id, comments.id, users.name,
+               snippet(comments_fts, 0, ?, ?, '...', 16), comments.created_at,
+               bm25(comments_fts)
+        FROM comments_fts
+        JOIN comments ON comments.id = comments_fts.rowid
+        JOIN users ON users.id = comments.user_id
+        WHERE comments_fts MATCH ?
+    )
+    ORDER BY rank, created_at DESC
+    LIMIT ? OFFSET ?
+"""
+
+HOT_QUERIES = {
+    "forum_posts": (FORUM_POSTS_SQL, (20,)),
+    "forum_posts_before": (FORUM_POSTS_BEFORE_SQL, ("2024-01-01 00:00:00", 1, 20)),
+    "post_comments": (POST_COMMENTS_SQL, (1,)),
+    "forum_comments": (FORUM_COMMENTS_SQL, ("[1, 2, 3]",)),
+    "recent_regulations": (RECENT_REGULATIONS_SQL, (3,)),
+    "user_responses": (USER_RESPONSES_SQL, (1,)),
+    "forum_search": (FORUM_SEARCH_SQL, ("**", "**", '"ethics"', "**", "**", '"ethics"', 10, 0)),
+}
+
+def find_table_scans(conn, queries=None):
+    """
+    Run EXPLAIN QUERY PLAN over the hot queries and return (name, plan detail)
+    for every step that scans a whole table instead of using an index.
+    """
+    scans = []
+    for name, (sql, params) in (queries or HOT_QUERIES).items():
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+            detail = row[-1]
+            # Scans of a materialized subquery (e.g. a UNION of searches) aren't table scans
+            if detail.startswith("SCAN (subquery"):
+                continue
+            if detail.startswith("SCAN ") and " USING " not in detail and "VIRTUAL TABLE" not in detail:
+                scans.append((name, detail))
+    return scans
+
+@st.cache_resource
+def _init_db_once(db_path):
+    with connection(db_path) as conn:
+        migrate(conn)
+        with conn:
+            sync_question_catalog(conn.cursor())
+        # Plans depend on the data and its ANALYZE statistics (a tiny users table is
+        # cheaper to scan), so scans are only reported on the Metrics page here;
+        # tests/test_query_plans.py checks the plans against representative data
+        return find_table_scans(conn)
+
+# Initialize SQLite database
+def init_db():
+    """
+    Bring the schema up to date. Only the first call in a process touches the database.
+    """
+    _init_db_once(get_db_path())
+
+def get_hot_query_scans():
+    """
+    (name, plan detail) of the hot-query steps that scanned a whole table when this
+    process opened the database.
+    """
+    return _init_db_once(get_db_path())
+
+# Process-wide read cache. Entries are keyed by the data version they were read at;
+# every forum/regulation write bumps the version, so stale entries are never served.
+READ_CACHE_MAX_ENTRIES = 512
+
+class ReadCache:
+    """
+    Bounded LRU cache of query results, invalidated by a data-version counter.
+    """
+    def __init__(self, max_entries=READ_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            version = self.version
+            entry_key = (version, key)
+            if entry_key in self._entries:
+                self._entries.move_to_end(entry_key)
+                self.hits += 1
+                return self._entries[entry_key]
+            self.misses += 1
+        value = loader()
+        with self._lock:
+            # Drop results that raced with a write; they may already be stale
+            if self.version == version:
+                self._entries[entry_key] = value
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def bump_version(self):
+        with self._lock:
+            self.version += 1
+            # Older versions can never be hit again
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+@st.cache_resource
+def get_read_cache():
+    return ReadCache(int(get_setting("read_cache_max_entries", READ_CACHE_MAX_ENTRIES)))
+
+def cached_read(func):
+    """
+    Serve a read function's results from the shared read cache.
+    Arguments must be hashable (lists are converted to tuples).
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (
+            func.__name__,
+            get_db_path(),
+            tuple(tuple(a) if isinstance(a, list) else a for a in args),
+            tuple(sorted(kwargs.items())),
+        )
+        return get_read_cache().get_or_load(key, lambda: func(*args, **kwargs))
+    return wrapper
+
+def bump_data_version():
+    get_read_cache().bump_version()
+
+def read_cache_stats():
+    return get_read_cache().stats()
+
+@cached_read
+@instrumented("db", rows=len, log_args=("limit", "before"))
+def get_posts(limit=None, before=None):
+    """
+    Fetch posts newest first as (id, author, content, created_at, comment_count).
+    `before` is the (created_at, id) of the last post already shown; only older
+    posts are returned. A limit of None returns every remaining post.
+    """
+    limit = -1 if limit is None else limit
+    with connection() as conn:
+        cursor = conn.cursor()
+        if before is None:
+            cursor.execute(FORUM_POSTS_SQL, (limit,))
+        else:
+            cursor.execute(FORUM_POSTS_BEFORE_SQL, (*before, limit))
+        posts = cursor.fetchall()
+    return posts
+
+@instrumented("db", log_args=("post_id", "parent_comment_id"))
+def insert_comment(post_id, user_id, content, parent_comment_id=None):
+    return _insert(
+        "INSERT INTO comments (post_id, user_id, content, parent_comment_id) VALUES (?, ?, ?, ?)",
+        (post_id, user_id, content, parent_comment_id)
+    )
+
+
+# HTTP transport for the LLM backends: one pooled session per process, connect/read
+# timeouts, jittered retries on rate limits and server errors, and a cap on in-flight calls
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class LLMClient:
+    """
+    Pooled, timeout-bounded, retrying HTTP client for LLM APIs.
+    """
+    def __init__(self, connect_timeout=5.0, read_timeout=60.0, max_retries=3,
+                 backoff_base=0.5, backoff_max=8.0, max_concurrency=4):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _backoff(self, attempt, retry_after=None):
+        # Full jitter, but never sooner than the server asked for. Returns None if it
+        # asked for longer than backoff_max: better to fail than to stall the caller.
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        try:
+            retry_after = float(retry_after)
+        except (TypeError, ValueError):
+            return delay
+        if retry_after > self.backoff_max:
+            return None
+        return max(delay, retry_after)
+
+    @contextlib.contextmanager
+    def post(self, url, headers, payload, stream=False):
+        """
+        POST a JSON payload, retrying connection errors, timeouts and RETRY_STATUSES,
+        and yield the successful response. A Retry-After longer than backoff_max
+        raises right away. A concurrency slot is held until the with-block exits,
+        so streamed bodies count as in flight while being read.
+        """
+        attempt = 0
+        while True:
+            self._slots.acquire()
+            try:
+                response = self.session.post(url, headers=headers, json=payload, timeout=self.timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._slots.release()
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            except BaseException:
+                # e.g. InvalidSchema for a bad URL; a leaked slot would block every later call
+                self._slots.release()
+                raise
+            delay = None
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = self._backoff(attempt, response.headers.get("Retry-After"))
+            if delay is not None:
+                response.close()
+                self._slots.release()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            try:
+                response.raise_for_status()
+                yield response
+            finally:
+                response.close()
+                self._slots.release()
+            return
+
+@st.cache_resource
+def get_llm_client():
+    return LLMClient(
+        connect_timeout=float(get_setting("llm_connect_timeout", 5.0)),
+        read_timeout=float(get_setting("llm_read_timeout", 60.0)),
+        max_retries=int(get_setting("llm_max_retries", 3)),
+        max_concurrency=int(get_setting("llm_max_concurrency", 4)),
+    )
+
+def _sse_events(response):
+    """
+    Yield the JSON payloads of a server-sent event stream.
+    """
+    for line in response.iter_lines():
+        if line.startswith(b"data:"):
+            data = line[len(b"data:"):].strip()
+            if data == b"[DONE]":
+                return
+            yield json.loads(data)
+
+# LLM backends. All of them expose generate(prompt) and stream(prompt), and record each
+# call's latency, time to first token and tokens in get_metrics() (see llm_backend_metrics);
+# which one is used comes from the llm_backend setting.
+class LLMBackend:
+    """
+    Base class for the LLM backends; subclasses implement _generate and _stream.
+    """
+    name = "base"
+
+    def __init__(self, model):
+        self.model = model
+
+    @property
+    def model_id(self):
+        return f"{self.name}:{self.model}"
+
+    def _record(self, operation, started, prompt, text=None, first_token_at=None):
+        finished = time.perf_counter()
+        failed = text is None
+        get_metrics().observe(
+            "llm", f"{self.name}.{operation}", finished - started, error=failed, detail=self.model_id,
+            prompt_chars=len(prompt),
+            response_chars=None if failed else len(text),
+            tokens=None if failed else estimate_tokens(text),
+            first_token_seconds=None if failed else (first_token_at or finished) - started,
+        )
+
+    def generate(self, prompt):
+        started = time.perf_counter()
+        try:
+            text = self._generate(prompt)
+        except Exception:
+            self._record("generate", started, prompt)
+            raise
+        self._record("generate", started, prompt, text)
+        return text
+
+    def stream(self, prompt):
+        started = time.perf_counter()
+        first_token_at = None
+        parts = []
+        try:
+            for chunk in self._stream(prompt):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(chunk)
+                yield chunk
+        except Exception:
+            self._record("stream", started, prompt)
+            raise
+        self._record("stream", started, prompt, "".join(parts), first_token_at)
+
+    def _generate(self, prompt):
+        raise NotImplementedError
+
+    def _stream(self, prompt):
+        # Backends without streaming deliver everything in one piece
+        yield self._generate(prompt)
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key, url=API_URL, client=None):
+        super().__init__(url.rsplit("/", 1)[-1].split(":")[0])
+        self.url = url
+        self.api_key = str(api_key)
+        self.client = client or get_llm_client()
+
+    @property
+    def model_id(self):
+        return f"{self.name}:{self.url}"
+
+    def _headers(self):
+        return {
+            "Content-Type": "application/json",
+            "x-goog-api-key": self.api_key
+        }
+
+    def _payload(self, prompt):
+        return {
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": GENERATION_CONFIG
+        }
+
+    @staticmethod
+    def _candidate_text(response_data):
+        parts = response_data['candidates'][0]['content']['parts']
+        return "".join(part.get('text', '') for part in parts)
+
+    def _generate(self, prompt):
+        with self.client.post(self.url, self._headers(), self._payload(prompt)) as response:
+            return self._candidate_text(response.json())
+
+    def _stream(self, prompt):
+        stream_url = self.url.replace(":generateContent", ":streamGenerateContent") + "?alt=sse"
+        with self.client.post(stream_url, self._headers(), self._payload(prompt), stream=True) as response:
+            for event in _sse_events(response):
+                text = self._candidate_text(event)
+                if text:
+                    yield text
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    Any /v1/chat/completions server: Ollama, llama.cpp, vLLM, LM Studio...
+    """
+    name = "local"
+
+    def __init__(self, base_url="http://localhost:11434/v1", model="llama3.1", api_key=None, client=None):
+        super().__init__(model)
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.api_key = api_key
+        self.client = client or get_llm_client()
+
+    @property
+    def model_id(self):
+        return f"{self.name}:{self.model}@{self.url}"
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def _payload(self, prompt, stream=False):
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": GENERATION_CONFIG["temperature"],
+            "max_tokens": GENERATION_CONFIG["maxOutputTokens"],
+            "stream": stream,
+        }
+
+    def _generate(self, prompt):
+        with self.client.post(self.url, self._headers(), self._payload(prompt)) as response:
+            return response.json()['choices'][0]['message']['content']
+
+    def _stream(self, prompt):
+        with self.client.post(self.url, self._headers(), self._payload(prompt, stream=True), stream=True) as response:
+            for event in _sse_events(response):
+                text = event['choices'][0].get('delta', {}).get('content')
+                if text:
+                    yield text
+
+class FakeBackend(LLMBackend):
+    """
+    Deterministic offline backend for benchmarks and demos: the output depends only
+    on the prompt, and latency and throughput are simulated.
+    """
+    name = "fake"
+
+    def __init__(self, latency=0.0, tokens_per_second=0.0, output_words=200):
+        super().__init__("deterministic")
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_words = output_words
+
+    def _words(self, prompt):
+        digest = hashlib.sha256(prompt.encode()).hexdigest()
+        words = [f"- Guideline {digest[:8]}:"]
+        vocabulary = ["safety", "transparency", "fairness", "accountability", "human", "life", "risk", "rules"]
+        for i in range(self.output_words):
+            words.append(vocabulary[int(digest[i % len(digest)], 16) % len(vocabulary)])
+        return words
+
+    def _stream(self, prompt):
+        if self.latency:
+            time.sleep(self.latency)
+        for word in self._words(prompt):
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            yield word + " "
+
+    def _generate(self, prompt):
+        return "".join(self._stream(prompt))
+
+def get_llm_backend_name():
+    return str(get_setting("llm_backend", "gemini")).lower()
+
+@st.cache_resource
+def _create_llm_backend(name, api_key):
+    if name == "gemini":
+        return GeminiBackend(api_key, url=get_setting("gemini_url", API_URL))
+    if name in ("local", "ollama", "openai"):
+        return OpenAICompatibleBackend(
+            base_url=get_setting("llm_base_url", "http://localhost:11434/v1"),
+            model=get_setting("llm_model", "llama3.1"),
+            api_key=get_setting("llm_api_key"),
+        )
+    if name == "fake":
+        return FakeBackend(
+            latency=float(get_setting("fake_llm_latency", 0.0)),
+            tokens_per_second=float(get_setting("fake_llm_tokens_per_second", 0.0)),
+        )
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+def get_llm_backend(api_key=None):
+    """
+    Return the process-wide backend selected by the llm_backend setting
+    (gemini, local/ollama/openai or fake).
+    """
+    return _create_llm_backend(get_llm_backend_name(), api_key)
+
+# Not instrumented itself (it takes the API key); the backends record every call
+def call_llm(prompt, api_key):
+    try:
+        return get_llm_backend(api_key).generate(prompt)
+    except requests.exceptions.RequestException as e:
+        st.error(f"API Request Error: {e}")
+        return None
+    except (KeyError, IndexError, ValueError) as e:
+        st.error(f"Response Parsing Error: {e}")
+        return None
+
+# Bump when build_regulation_prompt changes, so older stored regulations aren't reused
+REGULATION_PROMPT_VERSION = 1
+
+@instrumented("db")
+def regulation_input_hash(model_id):
+    """
+    Hash a snapshot of everything a generated regulation depends on: the users and
+    responses (by max id and count) and the model settings.
+    """
+    with connection() as conn:
+        snapshot = {
+            "users": conn.execute("SELECT MAX(id), COUNT(*) FROM users").fetchone(),
+            "responses": conn.execute("SELECT MAX(id), COUNT(*) FROM responses").fetchone(),
+            "model": model_id,
+            "generation_config": GENERATION_CONFIG,
+            "prompt_version": REGULATION_PROMPT_VERSION,
+        }
+    return hashlib.sha256(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()
+
+@instrumented("db")
+def get_stored_regulation(input_hash):
+    """
+    Return (id, content) of the latest regulation generated from this input, or None.
+    """
+    with connection() as conn:
+        return conn.execute(
+            "SELECT id, content FROM regulations WHERE input_hash = ? ORDER BY id DESC LIMIT 1", (input_hash,)
+        ).fetchone()
+
+def create_regulation(api_key, force=False, on_text=None, on_progress=None):
+    """
+    Generate comprehensive regulations with the configured LLM backend and store them.
+    If nothing changed since an earlier generation its result is reused, unless force is set.
+    on_text, if given, is called with the text received so far as it streams in;
+    on_progress, if given, after each stored summary.
+    Returns (regulation_id, content); raises if generation or summarization fails,
+    in which case nothing is stored.
+    """
+    backend = get_llm_backend(api_key)
+    input_hash = regulation_input_hash(backend.model_id)
+    if not force:
+        stored = get_stored_regulation(input_hash)
+        if stored:
+            return stored
+
+    # A partial summary would drop the newest answers, and the result would then be
+    # stored and reused for this snapshot; better to fail and let the user retry
+    if not summarize_free_text(api_key, on_progress=on_progress):
+        raise RuntimeError("Summarizing the free-text answers failed; please try again")
+    prompt = build_regulation_prompt(get_response_stats(), get_response_samples(), get_response_summaries())
+    parts = []
+    for chunk in backend.stream(prompt):
+        parts.append(chunk)
+        if on_text:
+            on_text("".join(parts))
+    regulation = "".join(parts)
+    if not regulation:
+        raise RuntimeError("The model returned no text")
+    return store_regulation(regulation, input_hash, backend.model_id), regulation
+
+# Regulation Generation Function
+def generate_regulation(api_key, force=False):
+    """
+    Generate comprehensive regulations synchronously; returns the text or None.
+    The app itself goes through the background job queue instead.
+    """
+    try:
+        return create_regulation(api_key, force)[1]
+    except Exception as e:
+        st.error(f"Regulation generation error: {e}")
+        return None
+
+# Background regulation jobs. The page only submits a job and polls it; a worker thread
+# per process claims queued jobs from the regulation_jobs table and runs them.
+# Requests for the same input while a job is pending share that job.
+JOB_POLL_SECONDS = 2.0
+JOB_HEARTBEAT_SECONDS = 10  # how often a running job records that it is alive
+# Running jobs not heard from for this long are assumed dead and requeued. It must
+# exceed the longest single LLM call, retries included, between two heartbeats.
+JOB_STALE_SECONDS = 600
+JOB_STATUSES = ("queued", "running", "done", "failed")
+JOB_STAGES = ("wait", "run", "total")  # queued -> started -> finished
+
+def submit_regulation_job(api_key, force=False):
+    """
+    Queue a regulation generation and return the job id; an identical pending job is reused.
+    """
+    input_hash = regulation_input_hash(get_llm_backend(api_key).model_id)
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            row = cursor.execute("""
+                SELECT id FROM regulation_jobs
+                WHERE input_hash = ? AND status IN ('queued', 'running') AND force >= ?
+                ORDER BY id LIMIT 1
+            """, (input_hash, int(force))).fetchone()
+            if row:
+                job_id = row[0]
+            else:
+                job_id = cursor.execute(
+                    "INSERT INTO regulation_jobs (input_hash, force, created_at) VALUES (?, ?, ?)",
+                    (input_hash, int(force), time.time())
+                ).lastrowid
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    get_regulation_worker().wake()
+    return job_id
+
+@instrumented("db", log_args=("job_id",))
+def get_regulation_job(job_id):
+    """
+    Return the job as a dict, including the partial text while it is running in this process.
+    """
+    with connection() as conn:
+        row = conn.execute("""
+            SELECT j.id, j.status, j.error, j.created_at, j.started_at, j.finished_at, j.regulation_id, r.content
+            FROM regulation_jobs j
+            LEFT JOIN regulations r ON r.id = j.regulation_id
+            WHERE j.id = ?
+        """, (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(zip(("id", "status", "error", "created_at", "started_at", "finished_at", "regulation_id", "content"), row))
+    if job["status"] == "running":
+        job["content"] = get_regulation_worker().partial_text(job_id)
+    return job
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+@instrumented("db")
+def regulation_job_metrics(recent=100):
+    """
+    Queue depth and wait/run latencies (seconds) of the most recent finished jobs.
+    """
+    with connection() as conn:
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM regulation_jobs GROUP BY status").fetchall())
+        finished = conn.execute("""
+            SELECT started_at - created_at, finished_at - started_at, finished_at - created_at
+            FROM regulation_jobs
+            WHERE status = 'done'
+            ORDER BY id DESC LIMIT ?
+        """, (recent,)).fetchall()
+    metrics = {status: counts.get(status, 0) for status in JOB_STATUSES}
+    for idx, name in enumerate(JOB_STAGES):
+        values = [row[idx] for row in finished]
+        metrics[f"{name}_p50"] = _percentile(values, 0.5)
+        metrics[f"{name}_p95"] = _percentile(values, 0.95)
+    return metrics
+
+class RegulationWorker:
+    """
+    Daemon thread that runs queued regulation jobs one at a time.
+    """
+    def __init__(self):
+        self._wake = threading.Event()
+        self._partial = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="regulation-worker", daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def partial_text(self, job_id):
+        with self._lock:
+            return self._partial.get(job_id)
+
+    def _claim(self):
+        with connection() as conn, conn:
+            # Jobs claimed before heartbeats existed only have started_at
+            conn.execute("""
+                UPDATE regulation_jobs SET status = 'queued', started_at = NULL, heartbeat_at = NULL
+                WHERE status = 'running' AND COALESCE(heartbeat_at, started_at) < ?
+            """, (time.time() - JOB_STALE_SECONDS,))
+            now = time.time()
+            return conn.execute("""
+                UPDATE regulation_jobs SET status = 'running', started_at = ?, heartbeat_at = ?
+                WHERE id = (SELECT id FROM regulation_jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+                RETURNING id, force
+            """, (now, now)).fetchone()
+
+    def _heartbeat(self, job_id):
+        with connection() as conn, conn:
+            conn.execute(
+                "UPDATE regulation_jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                (time.time(), job_id)
+            )
+
+    def _finish(self, job_id, status, regulation_id=None, error=None):
+        with connection() as conn, conn:
+            conn.execute("""
+                UPDATE regulation_jobs SET status = ?, regulation_id = ?, error = ?, finished_at = ?
+                WHERE id = ?
+            """, (status, regulation_id, error, time.time(), job_id))
+        with self._lock:
+            self._partial.pop(job_id, None)
+
+    def _run_job(self, job_id, force):
+        last_beat = time.monotonic()
+
+        def on_progress():
+            nonlocal last_beat
+            if time.monotonic() - last_beat >= JOB_HEARTBEAT_SECONDS:
+                self._heartbeat(job_id)
+                last_beat = time.monotonic()
+
+        def on_text(text):
+            with self._lock:
+                self._partial[job_id] = text
+            on_progress()
+        try:
+            regulation_id, _ = create_regulation(get_api_key(), bool(force), on_text, on_progress)
+        except Exception as e:
+            self._finish(job_id, "failed", error=str(e))
+        else:
+            self._finish(job_id, "done", regulation_id=regulation_id)
+
+    def _run(self):
+        while True:
+            # Also poll, to pick up jobs submitted by other processes
+            self._wake.wait(JOB_POLL_SECONDS)
+            self._wake.clear()
+            try:
+                while True:
+                    job = self._claim()
+                    if job is None:
+                        break
+                    self._run_job(*job)
+            except sqlite3.Error:
+                # Usually a missing schema or a locked database; try again on the next poll
+                pass
+
+@st.cache_resource
+def get_regulation_worker():
+    return RegulationWorker()
+
+# Store Regulation Function
+@instrumented("db")
+def store_regulation(regulation, input_hash=None, model=None):
+    """
+    Store generated regulation in SQLite database
+    """
+    with connection() as conn, conn:
+        cursor = conn.execute(
+            "INSERT INTO regulations (content, input_hash, model) VALUES (?, ?, ?)", 
+            (regulation, input_hash, model)
+        )
+    bump_data_version()
+    return cursor.lastrowid
+
+@cached_read
+@instrumented("db", rows=len, log_args=("limit",))
+def get_recent_regulations(limit=3):
+    with connection() as conn:
+        return conn.execute(RECENT_REGULATIONS_SQL, (limit,)).fetchall()
+
+# Question catalog. Answers are stored as integer codes: responses.question_id, and
+# responses.option_id for choice questions, whose text is looked up here.
+def sync_question_catalog(cursor):
+    """
+    Add any new questions and options from QUESTIONS to the catalog
+    and update the text of existing ones.
+    """
+    for idx, item in enumerate(QUESTIONS, 1):
+        key = f"Q{idx}"
+        row = cursor.execute("SELECT id FROM questions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            cursor.execute(
+                "INSERT INTO questions (key, text, input_type) VALUES (?, ?, ?)",
+                (key, item["question"], item["input_type"])
+            )
+            question_id = cursor.lastrowid
+        else:
+            question_id = row[0]
+            cursor.execute(
+                "UPDATE questions SET text = ?, input_type = ? WHERE id = ? AND (text != ? OR input_type != ?)",
+                (item["question"], item["input_type"], question_id, item["question"], item["input_type"])
+            )
+        cursor.executemany(
+            "INSERT INTO options (question_id, label) VALUES (?, ?) ON CONFLICT DO NOTHING",
+            [(question_id, label) for label in item.get("options", [])]
+        )
+
+@st.cache_resource
+def _load_question_catalog(db_path):
+    with connection(db_path) as conn:
+        catalog = {
+            key: (question_id, input_type, {})
+            for question_id, key, input_type in conn.execute("SELECT id, key, input_type FROM questions")
+        }
+        by_id = {question_id: options for question_id, _, options in catalog.values()}
+        for option_id, question_id, label in conn.execute("SELECT id, question_id, label FROM options"):
+            by_id[question_id][label] = option_id
+    return catalog
+
+def get_question_catalog():
+    """
+    Return {question key: (question_id, input_type, {option label: option_id})}.
+    """
+    init_db()
+    return _load_question_catalog(get_db_path())
+
+# Incremental aggregates over questionnaire answers. insert_responses keeps them up to
+# date, so the regulation prompt is built from a fixed amount of data however many
+# people have answered.
+RESPONDENTS_KEY = "*"  # question key under which respondents (distinct users) are counted
+RESPONDENTS_QUESTION_ID = 0  # ...and its code in response_stats
+RESPONSE_SAMPLE_SIZE = 20  # free-text answers kept per question
+MAX_SAMPLE_CHARS = 500
+AGE_BANDS = [(18, "<18"), (25, "18-24"), (35, "25-34"), (45, "35-44"), (55, "45-54"), (65, "55-64")]
+BREAKDOWN_DIMENSIONS = [("age_band", "Age band"), ("gender", "Gender"), ("knows_autonomous", "Knows about autonomous vehicles")]
+
+def age_band(age):
+    if age is None:
+        return "unknown"
+    for upper, label in AGE_BANDS:
+        if age < upper:
+            return label
+    return "65+"
+
+def _respondent_buckets(age, gender, knows_autonomous):
+    return [
+        ("all", ""),
+        ("age_band", age_band(age)),
+        ("gender", gender or "unknown"),
+        ("knows_autonomous", knows_autonomous or "unknown"),
+    ]
+
+def _sample_response(cursor, question, response_id, response):
+    """
+    Reservoir-sample one free-text answer, so every answer seen so far
+    is equally likely to be among the RESPONSE_SAMPLE_SIZE kept.
+    """
+    seen = cursor.execute("""
+        INSERT INTO response_sample_counts (question, seen) VALUES (?, 1)
+        ON CONFLICT (question) DO UPDATE SET seen = seen + 1
+        RETURNING seen
+    """, (question,)).fetchone()[0]
+    slot = seen - 1 if seen <= RESPONSE_SAMPLE_SIZE else random.randrange(seen)
+    if slot < RESPONSE_SAMPLE_SIZE:
+        cursor.execute(
+            "INSERT OR REPLACE INTO response_samples (question, slot, response_id, response) VALUES (?, ?, ?, ?)",
+            (question, slot, response_id, response[:MAX_SAMPLE_CHARS])
+        )
+
+def _record_response_aggregates(cursor, user, choices, new_respondent=True):
+    """
+    Fold one questionnaire submission into the option counts.
+    `user` is (age, gender, knows_autonomous); `choices` are (question_id, option_id).
+    Every submission's answers are counted, but a user only counts as a respondent
+    the first time (new_respondent).
+    """
+    buckets = _respondent_buckets(*user)
+    rows = []
+    if new_respondent:
+        rows.extend((RESPONDENTS_QUESTION_ID, 0, dimension, bucket) for dimension, bucket in buckets)
+    for question_id, option_id in choices:
+        rows.extend((question_id, option_id, dimension, bucket) for dimension, bucket in buckets)
+    cursor.executemany("""
+        INSERT INTO response_stats (question_id, option_id, dimension, bucket, count) VALUES (?, ?, ?, ?, 1)
+        ON CONFLICT (question_id, option_id, dimension, bucket) DO UPDATE SET count = count + 1
+    """, rows)
+
+def rebuild_response_aggregates(cursor, chunk_size=1000):
+    """
+    Recompute the aggregates from the raw responses, e.g. after a bulk import.
+    Each user counts once as a respondent.
+    """
+    cursor.execute("DELETE FROM response_stats")
+    cursor.execute("DELETE FROM response_samples")
+    cursor.execute("DELETE FROM response_sample_counts")
+
+    # Option counts come from integer GROUP BYs over idx_responses_option; only the
+    # distinct respondent profiles are folded into buckets here
+    counts = collections.Counter()
+    respondents = cursor.execute("""
+        SELECT u.age, u.gender, u.knows_autonomous, COUNT(*)
+        FROM (SELECT DISTINCT user_id FROM responses) r
+        LEFT JOIN users u ON u.id = r.user_id
+        GROUP BY u.age, u.gender, u.knows_autonomous
+    """).fetchall()
+    for age, gender, knows_autonomous, count in respondents:
+        for dimension, bucket in _respondent_buckets(age, gender, knows_autonomous):
+            counts[RESPONDENTS_QUESTION_ID, 0, dimension, bucket] += count
+    choices = cursor.execute("""
+        SELECT r.question_id, r.option_id, u.age, u.gender, u.knows_autonomous, COUNT(*)
+        FROM responses r
+        LEFT JOIN users u ON u.id = r.user_id
+        WHERE r.option_id IS NOT NULL
+        GROUP BY r.question_id, r.option_id, u.age, u.gender, u.knows_autonomous
+    """).fetchall()
+    for question_id, option_id, age, gender, knows_autonomous, count in choices:
+        for dimension, bucket in _respondent_buckets(age, gender, knows_autonomous):
+            counts[question_id, option_id, dimension, bucket] += count
+    cursor.executemany(
+        "INSERT INTO response_stats (question_id, option_id, dimension, bucket, count) VALUES (?, ?, ?, ?, ?)",
+        [key + (count,) for key, count in counts.items()]
+    )
+
+    # A separate cursor streams the free-text answers while `cursor` writes the samples
+    reader = cursor.connection.cursor()
+    reader.execute("""
+        SELECT q.key, r.id, TRIM(r.response)
+        FROM responses r
+        JOIN questions q ON q.id = r.question_id
+        WHERE r.option_id IS NULL AND TRIM(COALESCE(r.response, '')) != ''
+        ORDER BY r.id
+    """)
+    while True:
+        rows = reader.fetchmany(chunk_size)
+        if not rows:
+            break
+        for key, response_id, response in rows:
+            _sample_response(cursor, key, response_id, response)
+
+@cached_read
+@instrumented("db")
+def get_response_stats():
+    """
+    Return {question: {dimension: {bucket: {option: count}}}}; the number of
+    respondents (distinct users who answered) is under RESPONDENTS_KEY.
+    """
+    stats = {}
+    with connection() as conn:
+        for question, option, dimension, bucket, count in conn.execute("""
+            SELECT COALESCE(questions.key, ?), COALESCE(options.label, ''), dimension, bucket, count
+            FROM response_stats
+            LEFT JOIN questions ON questions.id = response_stats.question_id
+            LEFT JOIN options ON options.id = response_stats.option_id
+        """, (RESPONDENTS_KEY,)):
+            stats.setdefault(question, {}).setdefault(dimension, {}).setdefault(bucket, {})[option] = count
+    return stats
+
+@cached_read
+@instrumented("db")
+def get_response_samples():
+    """
+    Return {question: ([sampled answers], total free-text answers seen)}.
+    """
+    with connection() as conn:
+        samples = {
+            question: ([], seen)
+            for question, seen in conn.execute("SELECT question, seen FROM response_sample_counts")
+        }
+        for question, response in conn.execute(
+            "SELECT question, response FROM response_samples ORDER BY question, response_id"
+        ):
+            samples.setdefault(question, ([], 0))[0].append(response)
+    return samples
+
+def get_respondent_count(stats):
+    return stats.get(RESPONDENTS_KEY, {}).get("all", {}).get("", {}).get("", 0)
+
+def _format_counts(counts, total):
+    return ", ".join(
+        f"{option} {count} ({100 * count / total:.0f}%)"
+        for option, count in sorted(counts.items(), key=lambda item: -item[1])
+    )
+
+def build_regulation_prompt(stats, samples, summaries=None):
+    """
+    Build the regulation prompt from the aggregated answers. Free-text questions use
+    their stored summaries when there are any, and the sampled answers otherwise.
+    Its size depends on the questionnaire, not on the number of respondents.
+    """
+    summaries = summaries or {}
+    respondents = get_respondent_count(stats)
+    prompt = f"""
+    As an expert AI ethics consultant, create comprehensive ethical guidelines 
+    for autonomous vehicle development based on the following user perspectives.
+
+    Analyze the collected insights considering:
+    - Ethical decision-making frameworks
+    - Human life prioritization
+    - Transparency in AI decision processes
+    - Balancing individual and collective safety
+
+    Survey Results ({respondents} respondents):
+    """
+
+    # Who answered
+    respondent_stats = stats.get(RESPONDENTS_KEY, {})
+    for dimension, label in BREAKDOWN_DIMENSIONS:
+        buckets = respondent_stats.get(dimension, {})
+        if buckets:
+            prompt += f"\n- Respondents by {label}: " + ", ".join(
+                f"{bucket} {counts.get('', 0)}" for bucket, counts in sorted(buckets.items())
+            )
+
+    for idx, item in enumerate(QUESTIONS, 1):
+        key = f"Q{idx}"
+        prompt += f"\n\n- Critical Question {idx}: {item['question']}"
+        if key in summaries:
+            texts, summarized = summaries[key]
+            prompt += f"\n  Summary of {summarized} free-text answers:"
+            for text in texts:
+                prompt += "\n    " + text.strip().replace("\n", "\n    ")
+            continue
+        if key in FREE_TEXT_QUESTIONS:
+            answers, seen = samples.get(key, ([], 0))
+            prompt += f"\n  Representative answers ({len(answers)} sampled from {seen}):"
+            for answer in answers:
+                prompt += f"\n    - {answer}"
+            continue
+
+        question_stats = stats.get(key, {})
+        overall = question_stats.get("all", {}).get("", {})
+        total = sum(overall.values())
+        if not total:
+            prompt += "\n  No answers yet."
+            continue
+        prompt += f"\n  Overall: {_format_counts(overall, total)}"
+        for dimension, label in BREAKDOWN_DIMENSIONS:
+            breakdown = []
+            for bucket, counts in sorted(question_stats.get(dimension, {}).items()):
+                breakdown.append(f"{bucket}: {_format_counts(counts, sum(counts.values()))}")
+            if breakdown:
+                prompt += f"\n  By {label}: " + "; ".join(breakdown)
+
+    prompt += """
+
+    Deliverable Guidelines Requirements:
+    1. Provide clear, actionable recommendations
+    2. Address potential moral and ethical conflicts
+    3. Ensure transparency in autonomous vehicle decision-making
+    4. Consider diverse perspectives and edge cases
+    5. Create a robust ethical framework for AI developers
+
+    Format your response using markdown, with clear sections and bullet points.
+    """
+    return prompt
+
+# Map-reduce summarization of the free-text answers. New answers are split into
+# token-budgeted chunks that are summarized concurrently (map); once a question's stored
+# summaries outgrow the prompt budget, the oldest are merged into one (reduce).
+# Summaries are stored, so each run only summarizes answers newer than the last one.
+SUMMARY_CHUNK_TOKENS = 2000
+SUMMARY_PROMPT_TOKENS = 1500  # per question, in the final regulation prompt
+SUMMARY_WORKERS = 4
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+def chunk_responses(responses, max_tokens=SUMMARY_CHUNK_TOKENS):
+    """
+    Split (response_id, text) pairs into consecutive chunks of at most max_tokens each.
+    Overlong answers are truncated to fit a chunk on their own.
+    """
+    chunks, chunk, used = [], [], 0
+    for response_id, text in responses:
+        text = text[:max_tokens * 4]
+        tokens = estimate_tokens(text)
+        if chunk and used + tokens > max_tokens:
+            chunks.append(chunk)
+            chunk, used = [], 0
+        chunk.append((response_id, text))
+        used += tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def _summary_prompt(question, texts, merging=False):
+    kind = "summaries of answers" if merging else "answers"
+    prompt = f"""
+    The following are {kind} from a survey on the ethics of autonomous vehicles.
+    Question: {question}
+
+    Summarize the distinct viewpoints they express in a few concise bullet points,
+    noting roughly how common each one is. Do not quote anyone by name.
+    """
+    for text in texts:
+        prompt += f"\n- {text}"
+    return prompt
+
+@instrumented("db")
+def _store_summary(question, first_response_id, last_response_id, response_count, summary, replaces=()):
+    with connection() as conn, conn:
+        if replaces:
+            conn.execute(
+                "DELETE FROM response_summaries WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(replaces)),)
+            )
+        # A job requeued while still alive may store the same range twice; keep the first
+        conn.execute("""
+            INSERT INTO response_summaries (question, first_response_id, last_response_id, response_count, summary)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (question, first_response_id, last_response_id) DO NOTHING
+        """, (question, first_response_id, last_response_id, response_count, summary))
+
+def _summarize_new_answers(key, question, api_key, executor, on_progress=None):
+    question_id = get_question_catalog()[key][0]
+    with connection() as conn:
+        last_id = conn.execute(
+            "SELECT COALESCE(MAX(last_response_id), 0) FROM response_summaries WHERE question = ?", (key,)
+        ).fetchone()[0]
+        new_answers = conn.execute("""
+            SELECT id, TRIM(response) FROM responses
+            WHERE question_id = ? AND id > ? AND TRIM(COALESCE(response, '')) != ''
+            ORDER BY id
+        """, (question_id, last_id)).fetchall()
+    chunks = chunk_responses(new_answers)
+    futures = [
+        executor.submit(call_llm, _summary_prompt(question, [text for _, text in chunk]), api_key)
+        for chunk in chunks
+    ]
+    # Store in id order and stop at the first failure, so the next run resumes there
+    for chunk, future in zip(chunks, futures):
+        summary = future.result()
+        if not summary:
+            return False
+        _store_summary(key, chunk[0][0], chunk[-1][0], len(chunk), summary)
+        if on_progress:
+            on_progress()
+    return True
+
+def _reduce_summaries(key, question, api_key, on_progress=None):
+    while True:
+        # Not held across the LLM call below
+        with connection() as conn:
+            rows = conn.execute("""
+                SELECT id, first_response_id, last_response_id, response_count, summary
+                FROM response_summaries WHERE question = ? ORDER BY last_response_id
+            """, (key,)).fetchall()
+        if len(rows) < 2 or sum(estimate_tokens(row[4]) for row in rows) <= SUMMARY_PROMPT_TOKENS:
+            return True
+        # Merge the oldest summaries that fit in one chunk (at least two)
+        batch = chunk_responses([(row, row[4]) for row in rows])[0]
+        if len(batch) < 2:
+            batch = [(row, row[4]) for row in rows[:2]]
+        merged_rows = [row for row, _ in batch]
+        summary = call_llm(_summary_prompt(question, [text for _, text in batch], merging=True), api_key)
+        if not summary:
+            return False
+        _store_summary(
+            key,
+            min(row[1] for row in merged_rows),
+            max(row[2] for row in merged_rows),
+            sum(row[3] for row in merged_rows),
+            summary,
+            replaces=[row[0] for row in merged_rows],
+        )
+        if on_progress:
+            on_progress()
+
+def summarize_free_text(api_key, max_workers=SUMMARY_WORKERS, on_progress=None):
+    """
+    Bring the stored free-text summaries up to date. Returns True if every
+    question was fully summarized; on failure the next run resumes where this one stopped.
+    on_progress, if given, is called after each summary is stored.
+    """
+    ok = True
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for idx, item in enumerate(QUESTIONS, 1):
+            key = f"Q{idx}"
+            if key not in FREE_TEXT_QUESTIONS:
+                continue
+            ok = _summarize_new_answers(key, item["question"], api_key, executor, on_progress) and ok
+            ok = _reduce_summaries(key, item["question"], api_key, on_progress) and ok
+    return ok
+
+@instrumented("db")
+def get_response_summaries():
+    """
+    Return {question: ([summaries, oldest first], number of answers summarized)}.
+    """
+    summaries = {}
+    with connection() as conn:
+        for question, response_count, summary in conn.execute(
+            "SELECT question, response_count, summary FROM response_summaries ORDER BY question, last_response_id"
+        ):
+            texts, total = summaries.get(question, ([], 0))
+            texts.append(summary)
+            summaries[question] = (texts, total + response_count)
+    return summaries
+
+# Single-writer group commit. Inserts from all sessions go through one queue drained by
+# one writer thread, which commits everything pending in a single transaction (runs of the
+# same INSERT become one executemany), so bursts don't fight over SQLite's write lock.
+# It pays off with many concurrent writers (see benchmarks/loadtest_writes.py); with a
+# handful it is about even with committing directly, and a lone writer is a bit slower.
+WRITE_BATCH_MAX = 256
+# How long the writer waits for more writes to batch. Writes that arrive while a batch
+# commits already form the next batch, so waiting only adds latency: a 2ms window made
+# a lone submitter five times slower without raising throughput under load.
+WRITE_BATCH_WINDOW_SECONDS = 0.0
+
+class WriteQueue:
+    """
+    In-process write queue; callers get results (e.g. lastrowid) through futures.
+    """
+    def __init__(self, max_batch=WRITE_BATCH_MAX, window=WRITE_BATCH_WINDOW_SECONDS):
+        self.max_batch = max_batch
+        self.window = window
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def insert(self, sql, params):
+        """
+        Queue a single-row INSERT; the future resolves to its lastrowid.
+        """
+        return self._submit(sql, params)
+
+    def call(self, func, *args):
+        """
+        Queue func(cursor, *args) to run inside the writer's transaction;
+        the future resolves to its return value.
+        """
+        return self._submit(func, args)
+
+    def _submit(self, op, args):
+        future = concurrent.futures.Future()
+        self._queue.put((get_db_path(), op, args, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            by_path = {}
+            for item in batch:
+                by_path.setdefault(item[0], []).append(item[1:])
+            for db_path, items in by_path.items():
+                self._commit(db_path, items)
+
+    def _commit(self, db_path, items):
+        try:
+            with connection(db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    results = self._apply(cursor, items)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        except Exception as e:
+            if len(items) == 1:
+                items[0][2].set_exception(e)
+                return
+            # Find the culprit: retry each write in its own transaction
+            for item in items:
+                self._commit(db_path, [item])
+            return
+        self.batches += 1
+        self.writes += len(items)
+        bump_data_version()
+        for (_, _, future), result in zip(items, results):
+            future.set_result(result)
+
+    @staticmethod
+    def _apply(cursor, items):
+        results = []
+        i = 0
+        while i < len(items):
+            op, args, _ = items[i]
+            if callable(op):
+                results.append(op(cursor, *args))
+                i += 1
+                continue
+            # A run of the same INSERT goes in as one executemany. The writer holds the
+            # write lock, so the new rowids are consecutive and end at last_insert_rowid()
+            j = i
+            while j < len(items) and items[j][0] == op:
+                j += 1
+            cursor.executemany(op, [item[1] for item in items[i:j]])
+            last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+            results.extend(range(last_id - (j - i) + 1, last_id + 1))
+            i = j
+        return results
+
+@st.cache_resource
+def get_write_queue():
+    return WriteQueue()
+
+def write_queue_enabled():
+    return str(get_setting("write_queue", "1")).lower() not in ("0", "false", "no", "off")
+
+def _insert(sql, params):
+    """
+    Run a single-row INSERT through the write queue (or directly, if it's disabled)
+    and return its lastrowid.
+    """
+    if write_queue_enabled():
+        return get_write_queue().insert(sql, params).result()
+    with connection() as conn, conn:
+        cursor = conn.execute(sql, params)
+    bump_data_version()
+    return cursor.lastrowid
+
+def _write(func, *args):
+    """
+    Run func(cursor, *args) in a write transaction, through the write queue if enabled.
+    """
+    if write_queue_enabled():
+        return get_write_queue().call(func, *args).result()
+    with connection() as conn, conn:
+        result = func(conn.cursor(), *args)
+    bump_data_version()
+    return result
+
+# Existing functions for user and forum interactions remain the same
+@instrumented("db")
+def insert_user(name, age, gender, knows_autonomous):
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return _insert("""
+        INSERT INTO users (name, age, gender, knows_autonomous, timestamp)
+        VALUES (?, ?, ?, ?, ?)
+    """, (name, age, gender, knows_autonomous, timestamp))
+
+def _insert_responses(cursor, user_id, responses):
+    """
+    Store one submission ({question key: answer}); choice answers are stored as option codes.
+    """
+    catalog = get_question_catalog()
+    choices = []
+    first_id = None
+    for key, response in responses.items():
+        if key not in catalog:
+            raise ValueError(f"Unknown question: {key}")
+        question_id, input_type, options = catalog[key]
+        if input_type == "text_area":
+            cursor.execute("""
+                INSERT INTO responses (user_id, question_id, response)
+                VALUES (?, ?, ?)
+            """, (user_id, question_id, response))
+            first_id = first_id or cursor.lastrowid
+            if response and response.strip():
+                _sample_response(cursor, key, cursor.lastrowid, response.strip())
+        else:
+            if response not in options:
+                raise ValueError(f"Unknown option for {key}: {response}")
+            cursor.execute("""
+                INSERT INTO responses (user_id, question_id, option_id)
+                VALUES (?, ?, ?)
+            """, (user_id, question_id, options[response]))
+            first_id = first_id or cursor.lastrowid
+            choices.append((question_id, options[response]))
+    if first_id is None:
+        return
+    # Only a user's first submission makes them a respondent; checked after
+    # inserting, when this transaction already holds the write lock
+    answered_before = cursor.execute(
+        "SELECT 1 FROM responses WHERE user_id = ? AND id < ? LIMIT 1", (user_id, first_id)
+    ).fetchone()
+    user = cursor.execute(
+        "SELECT age, gender, knows_autonomous FROM users WHERE id = ?", (user_id,)
+    ).fetchone() or (None, None, None)
+    _record_response_aggregates(cursor, user, choices, new_respondent=answered_before is None)
+
+@instrumented("db")
+def insert_responses(user_id, responses):
+    _write(_insert_responses, user_id, responses)
+
+# Functions to handle posts and comments
+@instrumented("db")
+def insert_post(user_id, content):
+    return _insert("INSERT INTO posts (user_id, content) VALUES (?, ?)", (user_id, content))
+
+@cached_read
+@instrumented("db", rows=len, log_args=("post_id",))
+def get_comments(post_id):
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(POST_COMMENTS_SQL, (post_id,))
+        comments = cursor.fetchall()
+    return comments
+
+@cached_read
+@instrumented("db", rows=lambda comments: sum(map(len, comments.values())), log_args=("post_ids",))
+def get_comments_for_posts(post_ids):
+    """
+    Fetch the comments of several posts with one set-based query,
+    grouped by post id.
+    """
+    comments_by_post = {post_id: [] for post_id in post_ids}
+    if not comments_by_post:
+        return comments_by_post
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(FORUM_COMMENTS_SQL, (json.dumps(list(comments_by_post)),))
+        for comment in cursor.fetchall():
+            comments_by_post[comment[1]].append(comment)
+    return comments_by_post
+
+def get_forum_page_size():
+    return int(get_setting("forum_page_size", 20))
+
+def get_forum(limit=None, before=None, expanded=None):
+    """
+    Load a page of forum posts. Comments are fetched, in a single query, only for
+    the posts whose ids are in `expanded`; other threads get None.
+    Returns ([(post, comments), ...], next_cursor), where next_cursor is None on the last page.
+    """
+    posts = get_posts(None if limit is None else limit + 1, before)
+    next_cursor = None
+    if limit is not None and len(posts) > limit:
+        posts = posts[:limit]
+        next_cursor = (posts[-1][3], posts[-1][0])
+    expanded = set(expanded or ())
+    comments_by_post = get_comments_for_posts([post[0] for post in posts if post[0] in expanded])
+    return [(post, comments_by_post.get(post[0])) for post in posts], next_cursor
+
+def fts_query(text):
+    """
+    Turn free text from the search box into an FTS5 query that matches all of its
+    words, the last one as a prefix. Returns None if there is nothing to search for.
+    """
+    terms = re.findall(r"\w+", text)
+    if not terms:
+        return None
+    return " ".join(f'"{term}"' for term in terms) + "*"
+
+@cached_read
+@instrumented("db", rows=lambda result: len(result[0]), log_args=("limit", "offset"))
+def search_forum(text, limit=None, offset=0):
+    """
+    Search posts and comments, best matches (by bm25) first. Matched terms in the
+    snippets are wrapped in ** for markdown.
+    Returns ([(kind, post_id, id, author, snippet, created_at), ...], has_more).
+    """
+    query = fts_query(text)
+    if query is None:
+        return [], False
+    limit = limit or get_forum_page_size()
+    with connection() as conn:
+        rows = conn.execute(FORUM_SEARCH_SQL, ("**", "**", query, "**", "**", query, limit + 1, offset)).fetchall()
+    return rows[:limit], len(rows) > limit
+
+# Replies nested deeper than this are shown at the cap level
+MAX_COMMENT_DEPTH = 6
+
+class CommentNode:
+    """
+    A comment in a post's reply tree.
+    """
+    __slots__ = ("id", "post_id", "user_id", "content", "created_at", "parent_id", "author", "children")
+
+    def __init__(self, comment):
+        (self.id, self.post_id, self.user_id, self.content,
+         self.created_at, self.parent_id, self.author) = comment
+        self.children = []
+
+def build_comment_tree(comments):
+    """
+    Build the reply tree for a post's comments in linear time.
+    Returns the top-level comments; each node's children are sorted by created_at.
+    Comments whose parent is missing are treated as top-level.
+    """
+    nodes = {comment[0]: CommentNode(comment) for comment in comments}
+    roots = []
+    for node in nodes.values():
+        parent = nodes.get(node.parent_id)
+        (parent.children if parent is not None else roots).append(node)
+
+    def sort_key(node):
+        return (node.created_at or "", node.id)
+
+    roots.sort(key=sort_key)
+    for node in nodes.values():
+        node.children.sort(key=sort_key)
+    return roots
+
+def walk_comment_tree(roots, max_depth=MAX_COMMENT_DEPTH):
+    """
+    Yield (node, level) pairs in display order, without recursion.
+    Levels are capped at max_depth.
+    """
+    stack = [(node, 0) for node in reversed(roots)]
+    while stack:
+        node, level = stack.pop()
+        yield node, level
+        child_level = min(level + 1, max_depth)
+        stack.extend((child, child_level) for child in reversed(node.children))
+
+def comment_tree_to_dicts(roots):
+    """
+    Convert a comment tree into nested dicts, e.g. for exports.
+    """
+    def to_dict(node):
+        return {
+            "id": node.id,
+            "post_id": node.post_id,
+            "user_id": node.user_id,
+            "author": node.author,
+            "content": node.content,
+            "created_at": node.created_at,
+            "replies": [],
+        }
+
+    result = []
+    stack = [(node, result) for node in reversed(roots)]
+    while stack:
+        node, siblings = stack.pop()
+        item = to_dict(node)
+        siblings.append(item)
+        stack.extend((child, item["replies"]) for child in reversed(node.children))
+    return result
+
+# Streaming exports. Rows are read from a cursor in fixed-size chunks and written out
+# chunk by chunk (Parquet: one row group per chunk), so no table is ever held in memory.
+# since_id / since select only newer rows, for incremental pulls.
+EXPORT_TABLES = {
+    # table: timestamp column usable with `since`
+    "users": "timestamp",
+    "questions": None,
+    "options": None,
+    "responses": None,
+    "posts": "created_at",
+    "comments": "created_at",
+    "regulations": "created_at",
+}
+# Posts with their comment reply trees nested under them, one JSON object per post
+COMMENT_THREADS_EXPORT = "comment_threads"
+EXPORT_CHOICES = list(EXPORT_TABLES) + [COMMENT_THREADS_EXPORT]
+EXPORT_FORMATS = ["csv", "jsonl", "parquet"]
+EXPORT_CHUNK_ROWS = 1000
+
+def export_timestamp_column(table):
+    # Comment threads are selected by their posts
+    return EXPORT_TABLES["posts" if table == COMMENT_THREADS_EXPORT else table]
+
+def iter_export_chunks(table, since_id=None, since=None, chunk_size=EXPORT_CHUNK_ROWS):
+    """
+    Yield (columns, rows) chunks of a table in id order. The first chunk comes even
+    when no rows match, so writers still get the columns (e.g. for a CSV header).
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown table: {table}")
+    sql = f"SELECT * FROM {table} WHERE id > ?"
+    params = [since_id or 0]
+    if since is not None:
+        if EXPORT_TABLES[table] is None:
+            raise ValueError(f"{table} has no timestamp column; export it by id instead")
+        sql += f" AND {EXPORT_TABLES[table]} >= ?"
+        params.append(str(since))
+    # The connection stays checked out until the generator finishes or is closed
+    with connection() as conn:
+        cursor = conn.execute(sql + " ORDER BY id", params)
+        columns = [column[0] for column in cursor.description]
+        rows = cursor.fetchmany(chunk_size)
+        while True:
+            yield columns, rows
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+
+def _csv_chunks(chunks):
+    header_written = False
+    for columns, rows in chunks:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+def _jsonl_chunks(chunks):
+    for columns, rows in chunks:
+        yield "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+
+def _comment_thread_chunks(chunks):
     """
-    Retrieve Gemini API key from Streamlit secrets or fallback methods.
+    Add a "comments" column holding each post's reply tree to chunks of posts.
     """
-    # Retrieve from secrets, ensuring it's a clean string
-    try:
-        api_key = st.secrets["gemini"] if "gemini" in st.secrets else None
-    except Exception as e:
-        st.error(f"Error retrieving API key from secrets: {e}")
-        api_key = None
-    
-    # # User input fallback
-    # if not api_key:
-    #     api_key = st.text_input("Enter your Gemini API Key", type="password")
-    
-    return api_key
+    for columns, rows in chunks:
+        id_index = columns.index("id")
+        comments_by_post = {row[id_index]: [] for row in rows}
+        with connection() as conn:
+            for comment in conn.execute(FORUM_COMMENTS_SQL, (json.dumps(list(comments_by_post)),)):
+                comments_by_post[comment[1]].append(comment)
+        yield columns + ["comments"], [
+            row + (comment_tree_to_dicts(build_comment_tree(comments_by_post[row[id_index]])),)
+            for row in rows
+        ]
 
+def _parquet_schema(table):
+    import pyarrow as pa
+    types = {"INTEGER": pa.int64(), "REAL": pa.float64()}
+    with connection() as conn:
+        return pa.schema([
+            (name, types.get(declared_type.upper(), pa.string()))
+            for _, name, declared_type, *_ in conn.execute(f"PRAGMA table_info({table})")
+        ])
 
-# Gemini API endpoint
-API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent"
+@instrumented("db", rows=lambda result: result[0], log_args=("table", "fmt", "since_id", "since"))
+def export_table(table, fmt, out, since_id=None, since=None, chunk_size=EXPORT_CHUNK_ROWS):
+    """
+    Stream a table to `out` (a path or binary file object) as csv, jsonl or parquet.
+    COMMENT_THREADS_EXPORT exports posts with their reply trees, as jsonl only.
+    Returns (rows exported, last exported id); pass the id as since_id next time.
+    """
+    threads = table == COMMENT_THREADS_EXPORT
+    if threads and fmt != "jsonl":
+        raise ValueError("Comment threads can only be exported as jsonl")
+    exported, last_id = 0, since_id
 
-# Initialize SQLite database
-def init_db():
-    conn = sqlite3.connect("dtl_data.db")
-    cursor = conn.cursor()
-    # Create tables if not exists (existing table creation code)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            age INTEGER,
-            gender TEXT,
-            knows_autonomous TEXT,
-            timestamp TEXT
-        )
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS responses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            question TEXT,
-            response TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            content TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS comments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            post_id INTEGER,
-            user_id INTEGER,
-            parent_comment_id INTEGER,
-            content TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(post_id) REFERENCES posts(id),
-            FOREIGN KEY(user_id) REFERENCES users(id),
-            FOREIGN KEY(parent_comment_id) REFERENCES comments(id)
-        )
-    ''')
-    # Add regulations table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS regulations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            content TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    def track(chunks):
+        nonlocal exported, last_id
+        for columns, rows in chunks:
+            if rows:
+                exported += len(rows)
+                last_id = rows[-1][columns.index("id")]
+            yield columns, rows
 
-def get_posts():
-    conn = sqlite3.connect("dtl_data.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT posts.id, users.name, posts.content, posts.created_at
-        FROM posts
-        JOIN users ON posts.user_id = users.id
-        ORDER BY posts.created_at DESC
-    """)
-    posts = cursor.fetchall()
-    conn.close()
-    return posts
+    chunks = track(iter_export_chunks("posts" if threads else table, since_id, since, chunk_size))
+    if threads:
+        chunks = _comment_thread_chunks(chunks)
+    if fmt == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs the pyarrow package")
+        schema = _parquet_schema(table)
+        with pq.ParquetWriter(out, schema) as writer:
+            for columns, rows in chunks:
+                writer.write_table(pa.Table.from_pylist([dict(zip(columns, row)) for row in rows], schema=schema))
+    elif fmt in ("csv", "jsonl"):
+        encode = _csv_chunks if fmt == "csv" else _jsonl_chunks
+        with contextlib.ExitStack() as stack:
+            if isinstance(out, (str, os.PathLike)):
+                out = stack.enter_context(open(out, "wb"))
+            for text in encode(chunks):
+                out.write(text.encode("utf-8"))
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return exported, last_id
 
-def insert_comment(post_id, user_id, content, parent_comment_id=None):
-    conn = sqlite3.connect("dtl_data.db")
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO comments (post_id, user_id, content, parent_comment_id) VALUES (?, ?, ?, ?)",
-        (post_id, user_id, content, parent_comment_id)
+# Exports prepared for the Download Data page. Streamlit has no end-of-session hook, so
+# files are deleted once they are older than EXPORT_FILE_MAX_AGE_SECONDS, and the whole
+# directory when the process exits.
+EXPORT_FILE_MAX_AGE_SECONDS = 3600
+
+@st.cache_resource
+def _export_dir():
+    return tempfile.TemporaryDirectory(prefix="dtl_exports_")
+
+def prepare_export_file(table, fmt, since_id=None, since=None):
+    """
+    Export a table to a new file for download, first deleting expired exports.
+    Returns (path, rows exported, last exported id).
+    """
+    directory = _export_dir().name
+    expired = time.time() - EXPORT_FILE_MAX_AGE_SECONDS
+    for entry in os.scandir(directory):
+        with contextlib.suppress(FileNotFoundError):
+            if entry.stat().st_mtime < expired:
+                os.unlink(entry.path)
+    export_file = tempfile.NamedTemporaryFile(dir=directory, prefix=f"{table}_", suffix=f".{fmt}", delete=False)
+    try:
+        with export_file:
+            exported, last_id = export_table(table, fmt, export_file, since_id=since_id, since=since)
+    except Exception:
+        os.unlink(export_file.name)
+        raise
+    return export_file.name, exported, last_id
+
+def read_export_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+# Analytics over the choice answers. The raw responses are reduced by SQL GROUP BYs to
+# counts per (question, option, respondent profile) and per (question, option, sign-up
+# day); later loads only aggregate responses newer than the last one seen (a high-water
+# mark on responses.id) and fold them in. The frames' size depends on the number of
+# distinct profiles and days, not respondents, and everything below works on them with
+# vectorized pandas. A respondent is counted at their first response, so the counts
+# match response_stats however the loads are spaced.
+PROFILE_COLUMNS = ["question_id", "option_id", "age", "gender", "knows_autonomous", "count"]
+PROFILE_FACTS_SQL = """
+    SELECT r.question_id, r.option_id, u.age, u.gender, u.knows_autonomous, COUNT(*)
+    FROM responses r
+    LEFT JOIN users u ON u.id = r.user_id
+    WHERE r.id > ? AND r.id <= ? AND r.option_id IS NOT NULL
+    GROUP BY r.question_id, r.option_id, u.age, u.gender, u.knows_autonomous
+    UNION ALL
+    SELECT ?, 0, u.age, u.gender, u.knows_autonomous, COUNT(*)
+    FROM responses r
+    LEFT JOIN users u ON u.id = r.user_id
+    WHERE r.id > ? AND r.id <= ?
+      AND NOT EXISTS (SELECT 1 FROM responses p WHERE p.user_id = r.user_id AND p.id < r.id)
+    GROUP BY u.age, u.gender, u.knows_autonomous
+"""
+DAY_COLUMNS = ["question_id", "option_id", "day", "count"]
+DAY_FACTS_SQL = """
+    SELECT r.question_id, r.option_id, substr(u.timestamp, 1, 10) AS day, COUNT(*)
+    FROM responses r
+    LEFT JOIN users u ON u.id = r.user_id
+    WHERE r.id > ? AND r.id <= ? AND r.option_id IS NOT NULL
+    GROUP BY r.question_id, r.option_id, day
+    UNION ALL
+    SELECT ?, 0, substr(u.timestamp, 1, 10) AS day, COUNT(*)
+    FROM responses r
+    LEFT JOIN users u ON u.id = r.user_id
+    WHERE r.id > ? AND r.id <= ?
+      AND NOT EXISTS (SELECT 1 FROM responses p WHERE p.user_id = r.user_id AND p.id < r.id)
+    GROUP BY day
+"""
+TREND_PERIODS = {"Day": "D", "Week": "W", "Month": "M"}
+
+def _fold_counts(frame, sql, params, columns, conn):
+    new = pd.DataFrame(conn.execute(sql, params).fetchall(), columns=columns)
+    if frame.empty:
+        return new
+    return (
+        pd.concat([frame, new], ignore_index=True)
+        .groupby(columns[:-1], dropna=False, as_index=False, sort=False)["count"]
+        .sum()
     )
-    conn.commit()
-    conn.close()
 
+class AnalyticsStore:
+    """
+    Choice answer counts for one database, kept up to date incrementally.
+    """
 
-def call_gemini_api(prompt, api_key):
-    api_key=str(api_key)
-    headers = {
-        "Content-Type": "application/json",
-        "x-goog-api-key": api_key
-    }
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.last_response_id = 0
+        self.profiles = pd.DataFrame(columns=PROFILE_COLUMNS)
+        self.days = pd.DataFrame(columns=DAY_COLUMNS)
 
-    payload = {
-        "prompt": {
-            "text": prompt
-        },
-        "temperature": 0.7,
-        "maxOutputTokens": 1024
-    }
+    def refresh(self):
+        """
+        Fold in the responses stored since the last refresh.
+        Returns the (profiles, days) count frames.
+        """
+        with self.lock:
+            with connection(self.db_path) as conn:
+                last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM responses").fetchone()[0]
+                if last_id > self.last_response_id:
+                    params = (self.last_response_id, last_id, RESPONDENTS_QUESTION_ID, self.last_response_id, last_id)
+                    self.profiles = _fold_counts(self.profiles, PROFILE_FACTS_SQL, params, PROFILE_COLUMNS, conn)
+                    self.days = _fold_counts(self.days, DAY_FACTS_SQL, params, DAY_COLUMNS, conn)
+                    self.last_response_id = last_id
+            return self.profiles, self.days
 
-    try:
-        response = requests.post(API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        
-        response_data = response.json()
-        generated_text = response_data['candidates'][0]['output']
-        
-        return generated_text
-    
-    except requests.exceptions.RequestException as e:
-        st.error(f"API Request Error: {e}")
-        return None
-    except (KeyError, IndexError) as e:
-        st.error(f"Response Parsing Error: {e}")
-        return None
+@st.cache_resource
+def _analytics_store(db_path):
+    return AnalyticsStore(db_path)
 
-# Regulation Generation Function
-def generate_regulation(users, responses, api_key):
+@instrumented("db")
+def get_analytics_facts():
     """
-    Generate comprehensive regulations using Gemini API
+    Return up-to-date (profiles, days) DataFrames of counts, with PROFILE_COLUMNS and
+    DAY_COLUMNS. Respondents are counted under RESPONDENTS_QUESTION_ID; treat them as read-only.
     """
-    prompt = """
-    As an expert AI ethics consultant, create comprehensive ethical guidelines 
-    for autonomous vehicle development based on the following user perspectives.
+    return _analytics_store(get_db_path()).refresh()
 
-    Analyze the collected insights considering:
-    - Ethical decision-making frameworks
-    - Human life prioritization
-    - Transparency in AI decision processes
-    - Balancing individual and collective safety
+def age_bands(ages):
+    """
+    Vectorized age_band over a Series of ages.
+    """
+    edges = [-np.inf] + [upper for upper, _ in AGE_BANDS] + [np.inf]
+    labels = [label for _, label in AGE_BANDS] + ["65+"]
+    bands = pd.cut(pd.to_numeric(ages), edges, right=False, labels=labels)
+    return bands.cat.add_categories("unknown").fillna("unknown")
 
-    User Perspectives Compilation:
+def _question_facts(key, by_day=False):
     """
-    
-    # Add user responses to the prompt
-    for user in users:
-        user_id, name, age, gender, knows_autonomous, timestamp = user
-        prompt += f"\n- User Profile: {age} y/o {gender}, Autonomous Vehicle Knowledge: {knows_autonomous}"
-    
-    # Add detailed response information
-    for response in responses:
-        user_id, question, answer = response
-        prompt += f"\n- Critical Question: {question}\n  User Response: {answer}"
-    
-    prompt += """
+    Counts for one question key (or RESPONDENTS_KEY) with an `option` label column,
+    and the question's option labels.
+    """
+    profiles, days = get_analytics_facts()
+    facts = days if by_day else profiles
+    if key == RESPONDENTS_KEY:
+        facts = facts[facts["question_id"] == RESPONDENTS_QUESTION_ID]
+        return facts.assign(option="Respondents"), ["Respondents"]
+    catalog = get_question_catalog()
+    if key not in catalog or catalog[key][1] == "text_area":
+        raise ValueError(f"Not a choice question: {key}")
+    question_id, _, options = catalog[key]
+    facts = facts[facts["question_id"] == question_id]
+    labels = {option_id: label for label, option_id in options.items()}
+    return facts.assign(option=facts["option_id"].map(labels)), list(options)
 
-    Deliverable Guidelines Requirements:
-    1. Provide clear, actionable recommendations
-    2. Address potential moral and ethical conflicts
-    3. Ensure transparency in autonomous vehicle decision-making
-    4. Consider diverse perspectives and edge cases
-    5. Create a robust ethical framework for AI developers
+def question_distribution(key):
+    """
+    Return answer counts and shares for a choice question, most common first.
+    """
+    facts, options = _question_facts(key)
+    counts = facts.groupby("option")["count"].sum().reindex(options, fill_value=0)
+    counts = counts.sort_values(ascending=False)
+    return pd.DataFrame({"count": counts, "share": counts / max(counts.sum(), 1)})
 
-    Format your response using markdown, with clear sections and bullet points.
+def question_crosstab(key, dimension, normalize=True):
+    """
+    Cross-tabulate a choice question against one of BREAKDOWN_DIMENSIONS: a row per
+    bucket, a column per option, holding each bucket's shares (or counts).
+    """
+    if dimension not in dict(BREAKDOWN_DIMENSIONS):
+        raise ValueError(f"Unknown dimension: {dimension}")
+    facts, options = _question_facts(key)
+    if dimension == "age_band":
+        buckets = age_bands(facts["age"])
+    else:
+        buckets = facts[dimension].fillna("unknown")
+    table = (
+        facts.assign(bucket=buckets)
+        .pivot_table(index="bucket", columns="option", values="count", aggfunc="sum", fill_value=0, observed=True)
+        .reindex(columns=options, fill_value=0)
+    )
+    if normalize:
+        table = table.div(table.sum(axis=1).replace(0, 1), axis=0)
+    return table
+
+def question_trend(key, period="W"):
+    """
+    Return answer counts per period (rows, by respondents' sign-up time) and option (columns).
+    period is a pandas period alias such as "D", "W" or "M".
     """
+    facts, options = _question_facts(key, by_day=True)
+    starts = pd.to_datetime(facts["day"], errors="coerce").dt.to_period(period).dt.start_time
+    return (
+        facts.assign(period=starts)
+        .pivot_table(index="period", columns="option", values="count", aggfunc="sum", fill_value=0)
+        .reindex(columns=options, fill_value=0)
+    )
+
+def latency_quantile(stats, fraction):
+    """
+    Estimate a latency quantile (in seconds) of an instrumented call from its histogram:
+    the upper bound of the bucket holding it, or the slowest call for the last bucket.
+    """
+    target = fraction * stats["count"]
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+        cumulative += count
+        if cumulative >= target:
+            return min(bound, stats["max_seconds"])
+    return stats["max_seconds"]
+
+def llm_backend_metrics(calls):
+    """
+    Average latency, time to first token (seconds) and token throughput of each LLM
+    backend operation, e.g. "gemini.stream", from a get_metrics() snapshot's calls.
+    """
+    backends = {}
+    for (kind, name), stats in sorted(calls.items()):
+        if kind != "llm":
+            continue
+        ok = stats["count"] - stats["errors"]
+        totals = stats["totals"]
+        backends[name] = {
+            "calls": stats["count"],
+            "errors": stats["errors"],
+            "avg_latency": stats["seconds"] / stats["count"],
+            "avg_time_to_first_token": totals.get("first_token_seconds", 0.0) / ok if ok else 0.0,
+            "tokens_per_second": totals.get("tokens", 0) / stats["seconds"] if stats["seconds"] else 0.0,
+        }
+    return backends
+
+def metrics_text():
+    """
+    Render the instrumentation and read cache metrics in the Prometheus text format.
+    """
+    calls, _ = get_metrics().snapshot()
+    calls = sorted(calls.items())
+    lines = [
+        "# HELP dtl_call_duration_seconds Latency of instrumented DB, LLM and render calls.",
+        "# TYPE dtl_call_duration_seconds histogram",
+    ]
+    for (kind, name), stats in calls:
+        labels = f'kind="{kind}",name="{name}"'
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), stats["buckets"]):
+            cumulative += count
+            lines.append(f'dtl_call_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"dtl_call_duration_seconds_sum{{{labels}}} {stats['seconds']}")
+        lines.append(f"dtl_call_duration_seconds_count{{{labels}}} {stats['count']}")
+    lines += [
+        "# HELP dtl_call_errors_total Instrumented calls that raised.",
+        "# TYPE dtl_call_errors_total counter",
+    ]
+    lines += [f'dtl_call_errors_total{{kind="{kind}",name="{name}"}} {stats["errors"]}' for (kind, name), stats in calls]
+    # Result sizes: rows, prompt_chars, response_chars
+    for total in sorted({key for _, stats in calls for key in stats["totals"]}):
+        lines += [
+            f"# HELP dtl_call_{total}_total Total {total.replace('_', ' ')} of instrumented calls.",
+            f"# TYPE dtl_call_{total}_total counter",
+        ]
+        lines += [
+            f'dtl_call_{total}_total{{kind="{kind}",name="{name}"}} {stats["totals"][total]}'
+            for (kind, name), stats in calls if total in stats["totals"]
+        ]
+    # Per-backend averages since startup; rates over a window come from the totals above
+    backends = llm_backend_metrics(dict(calls))
+    for key, help_text in (
+        ("avg_time_to_first_token", "Average time to the first streamed token of each LLM backend operation."),
+        ("tokens_per_second", "Average generated tokens per second of each LLM backend operation."),
+    ):
+        metric = "dtl_llm_" + key.replace("avg_", "") + ("_seconds" if key.startswith("avg_") else "")
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        for name, figures in backends.items():
+            backend, _, operation = name.partition(".")
+            lines.append(f'{metric}{{backend="{backend}",operation="{operation}"}} {figures[key]}')
+    cache = read_cache_stats()
+    for key, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("entries", "gauge")):
+        metric = f"dtl_read_cache_{key}" + ("_total" if kind == "counter" else "")
+        lines += [f"# HELP {metric} Read cache {key}.", f"# TYPE {metric} {kind}", f"{metric} {cache[key]}"]
+    scans = collections.Counter(name for name, _ in get_hot_query_scans())
+    lines += [
+        "# HELP dtl_hot_query_table_scans Plan steps of each hot query that scan a whole table.",
+        "# TYPE dtl_hot_query_table_scans gauge",
+    ]
+    lines += [f'dtl_hot_query_table_scans{{query="{name}"}} {scans[name]}' for name in HOT_QUERIES]
+    jobs = regulation_job_metrics()
+    lines += [
+        "# HELP dtl_regulation_jobs Regulation jobs by status; queued is the queue depth.",
+        "# TYPE dtl_regulation_jobs gauge",
+    ]
+    lines += [f'dtl_regulation_jobs{{status="{status}"}} {jobs[status]}' for status in JOB_STATUSES]
+    lines += [
+        "# HELP dtl_regulation_job_seconds Wait, run and total time of the recent finished regulation jobs.",
+        "# TYPE dtl_regulation_job_seconds gauge",
+    ]
+    for stage in JOB_STAGES:
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95")):
+            if jobs[f"{stage}_{key}"] is not None:
+                lines.append(f'dtl_regulation_job_seconds{{stage="{stage}",quantile="{quantile}"}} {jobs[f"{stage}_{key}"]}')
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@st.cache_resource
+def start_metrics_server(port, host="127.0.0.1"):
+    """
+    Serve metrics_text() at http://host:port/metrics for Prometheus to scrape.
+    """
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
 
-    # Call Gemini API
+# Forum and regulation panels are fragments: interacting with one reruns only that
+# panel (and reloads only the data it owns) instead of the whole script
+def rerun_fragment():
+    """
+    Rerun just the calling fragment, or the whole app when this is a full run.
+    """
     try:
-        regulation = call_gemini_api(prompt, api_key)
-        
-        if regulation:
-            store_regulation(regulation)
-        
-        return regulation
-    except Exception as e:
-        st.error(f"Regulation generation error: {e}")
-        return None
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
 
-# Store Regulation Function
-def store_regulation(regulation):
+@st.fragment
+@instrumented("render")
+def forum_post_list():
+    if 'user_id' in st.session_state:
+        st.write("### Create a New Post")
+        new_post = st.text_area("What's on your mind?", key="new_post")
+        if st.button("Post", key="post_button"):
+            if new_post.strip():
+                insert_post(st.session_state['user_id'], new_post.strip())
+                st.session_state['forum_cursors'] = [None]  # Back to the newest page
+                st.success("Post created!")
+                rerun_fragment()  # Reload the post list to show the new post
+            else:
+                st.error("Post content cannot be empty.")
+    else:
+        st.warning("Please submit your details on the User Details page to post.")
+
+    st.write("---")
+    st.write("### Recent Posts")
+    # Cursors of the pages above the current one; the last entry is where this page starts
+    cursors = st.session_state.setdefault('forum_cursors', [None])
+    page_size = get_forum_page_size()
+    page_posts = st.session_state.get('forum_page_post_ids', [])
+    expanded = [post_id for post_id in page_posts if st.session_state.get(f"show_thread_{post_id}")]
+    forum, next_cursor = get_forum(page_size, cursors[-1], expanded)
+    st.session_state['forum_page_post_ids'] = [post[0] for post, _ in forum]
+    if forum:
+        for post, comments in forum:
+            # This run passes the thread fresh data, so it can stop reloading it
+            st.session_state.pop(f"thread_changed_{post[0]}", None)
+            forum_thread(post, comments)
+            st.write("---")
+
+        newer_col, older_col = st.columns(2)
+        if len(cursors) > 1 and newer_col.button("Newer posts", key="forum_newer"):
+            cursors.pop()
+            rerun_fragment()
+        if next_cursor is not None and older_col.button("Older posts", key="forum_older"):
+            cursors.append(next_cursor)
+            rerun_fragment()
+    else:
+        st.write("No posts yet. Be the first to post!")
+
+@st.fragment
+@instrumented("render")
+def forum_search():
+    text = st.text_input("Search posts and comments", key="forum_search")
+    if not text.strip():
+        return
+    # Start from the first page whenever the search changes
+    if st.session_state.get('forum_search_text') != text:
+        st.session_state['forum_search_text'] = text
+        st.session_state['forum_search_offset'] = 0
+    offset = st.session_state['forum_search_offset']
+    page_size = get_forum_page_size()
+    results, has_more = search_forum(text, page_size, offset)
+    if not results:
+        st.write("No matches.")
+        return
+
+    for kind, post_id, _, author, snippet, created_at in results:
+        where = "posted" if kind == "post" else f"commented on post #{post_id}"
+        st.markdown(f"**{author}** {where} at {created_at}")
+        st.markdown(f"> {snippet}")
+
+    previous_col, next_col = st.columns(2)
+    if offset and previous_col.button("Previous results", key="forum_search_previous"):
+        st.session_state['forum_search_offset'] = max(offset - page_size, 0)
+        rerun_fragment()
+    if has_more and next_col.button("More results", key="forum_search_next"):
+        st.session_state['forum_search_offset'] = offset + page_size
+        rerun_fragment()
+
+@st.fragment
+@instrumented("render")
+def forum_thread(post, comments=None):
     """
-    Store generated regulation in SQLite database
+    Render one post and its comment thread. `comments` is the batch-loaded thread,
+    if any; after a write in this thread only this fragment reruns and reloads it.
     """
-    conn = sqlite3.connect("dtl_data.db")
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "INSERT INTO regulations (content) VALUES (?)", 
-        (regulation,)
-    )
+    post_id, author_name, post_content, post_created_at, comment_count = post
+    st.markdown(f"**{author_name}** posted at {post_created_at}")
+    st.write(post_content)
+
+    # Fragment reruns get the arguments of the last post list run. Once this thread
+    # has been written to they are stale, so it reads its own comments (through the
+    # read cache) until the post list reloads it and clears the marker.
+    if st.session_state.get(f"thread_changed_{post_id}"):
+        comments = get_comments(post_id)
+
+    # Threads stay collapsed until the reader opens them
+    if comments is not None:
+        comment_count = len(comments)
+    show_thread = st.toggle(f"Show comments ({comment_count})", key=f"show_thread_{post_id}")
+    if not show_thread:
+        return
+    if comments is None:
+        comments = get_comments(post_id)
+
+    # Display the reply tree
+    for node, level in walk_comment_tree(build_comment_tree(comments)):
+        indent = "&nbsp;" * 4 * level
+        st.markdown(f"{indent}**{node.author}** replied at {node.created_at}")
+        st.markdown(f"{indent}{node.content}")
+
+        # Reply to comment; only the comment being answered gets a text box
+        if 'user_id' not in st.session_state:
+            continue
+        if st.session_state.get('replying_to') != node.id:
+            if st.button("Reply", key=f"reply_button_{node.id}"):
+                st.session_state['replying_to'] = node.id
+                rerun_fragment()
+        else:
+            reply_content = st.text_area(f"Reply to {node.author}", key=f"reply_{node.id}")
+            if st.button(f"Submit Reply to Comment {node.id}", key=f"submit_reply_{node.id}"):
+                if reply_content.strip():
+                    insert_comment(post_id, st.session_state['user_id'], reply_content.strip(), parent_comment_id=node.id)
+                    st.session_state.pop('replying_to', None)
+                    st.session_state[f"thread_changed_{post_id}"] = True
+                    st.success("Reply added!")
+                    rerun_fragment()  # Refresh this thread to show the new reply
+                else:
+                    st.error("Reply cannot be empty.")
+
+    # Add a comment to the post
+    if 'user_id' in st.session_state:
+        st.write("**Add a comment:**")
+        comment_content = st.text_input(f"Your comment on post {post_id}", key=f"comment_{post_id}")
+        if st.button(f"Submit Comment to Post {post_id}", key=f"submit_comment_{post_id}"):
+            if comment_content.strip():
+                insert_comment(post_id, st.session_state['user_id'], comment_content.strip())
+                st.session_state[f"thread_changed_{post_id}"] = True
+                st.success("Comment added!")
+                rerun_fragment()  # Refresh this thread to show the new comment
+            else:
+                st.error("Comment cannot be empty.")
+    else:
+        st.warning("Please submit your details to comment.")
+
+@st.fragment(run_every=1)
+def regulation_job_status():
+    """
+    Poll the submitted regulation job, showing the text generated so far.
+    """
+    job = get_regulation_job(st.session_state['regulation_job'])
+    if job is None or job["status"] in ("done", "failed"):
+        del st.session_state['regulation_job']
+        if job and job["status"] == "done":
+            # Kept so it survives the panel's own reruns (e.g. the save button below)
+            st.session_state['latest_regulation'] = job["content"]
+        else:
+            st.session_state['regulation_error'] = job["error"] if job else "Job not found"
+        st.rerun()
+
+    if job["status"] == "queued":
+        depth = regulation_job_metrics()["queued"]
+        st.info(f"Waiting for a worker ({depth} job(s) queued)...")
+    else:
+        st.markdown("### Generated Ethical Guidelines")
+        st.caption("Generating comprehensive guidelines...")
+        st.write(job["content"] or "")
+
+@st.fragment
+@instrumented("render")
+def regulation_panel():
+    # The API key is read here rather than passed in, so it never reaches the slow-call log
+    api_key = bootstrap()["api_key"]
+    # Aggregated answers; the raw responses never leave the database
+    stats = get_response_stats()
+
+    # Check if there are enough responses
+    if get_respondent_count(stats):
+        # Button to generate regulations
+        # Unchanged data reuses the last generated guidelines unless this is ticked
+        force = st.checkbox("Force regenerate", key="force_regenerate")
+        if st.button("Generate Ethical Guidelines"):
+            st.session_state['regulation_job'] = submit_regulation_job(api_key, force=force)
+            st.session_state['latest_regulation'] = None
+
+        if st.session_state.get('regulation_job'):
+            regulation_job_status()
+        elif st.session_state.get('latest_regulation'):
+            st.success("Guidelines Generated Successfully!")
+            st.markdown("### Generated Ethical Guidelines")
+            st.write(st.session_state['latest_regulation'])
+
+        error = st.session_state.pop('regulation_error', None)
+        if error:
+            st.error(f"Failed to generate guidelines: {error}")
+
+        regulation = st.session_state.get('latest_regulation')
+        if regulation:
+            # Option to save to file
+            if st.button("Save Guidelines to File"):
+                with open("autonomous_vehicle_ethics_guidelines.txt", "w") as f:
+                    f.write(regulation)
+                st.success("Guidelines saved to 'autonomous_vehicle_ethics_guidelines.txt'")
+    else:
+        st.warning("Insufficient data to generate regulations.")
+
+    # Display recent stored regulations
+    st.subheader("Previous Generated Guidelines")
+    previous_regulations = get_recent_regulations(3)
     
-    conn.commit()
-    conn.close()
+    for regulation, timestamp in previous_regulations:
+        with st.expander(f"Guidelines - {timestamp}"):
+            st.write(regulation)
 
-# Existing functions for user and forum interactions remain the same
-def insert_user(name, age, gender, knows_autonomous):
-    conn = sqlite3.connect("dtl_data.db")
-    cursor = conn.cursor()
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute("""
-        INSERT INTO users (name, age, gender, knows_autonomous, timestamp)
-        VALUES (?, ?, ?, ?, ?)
-    """, (name, age, gender, knows_autonomous, timestamp))
-    conn.commit()
-    user_id = cursor.lastrowid
-    conn.close()
-    return user_id
+@st.fragment
+@instrumented("render")
+def analytics_dashboard():
+    respondents = int(question_distribution(RESPONDENTS_KEY)["count"].sum())
+    st.metric("Respondents", respondents)
+    if not respondents:
+        st.info("No responses yet.")
+        return
 
-def insert_responses(user_id, responses):
-    conn = sqlite3.connect("dtl_data.db")
-    cursor = conn.cursor()
-    for question, response in responses.items():
-        cursor.execute("""
-            INSERT INTO responses (user_id, question, response)
-            VALUES (?, ?, ?)
-        """, (user_id, question, response))
-    conn.commit()
-    conn.close()
+    choice_questions = {
+        f"{idx}. {item['question']}": f"Q{idx}"
+        for idx, item in enumerate(QUESTIONS, 1) if f"Q{idx}" not in FREE_TEXT_QUESTIONS
+    }
+    key = choice_questions[st.selectbox("Question", list(choice_questions), key="analytics_question")]
 
-# Functions to handle posts and comments
-def insert_post(user_id, content):
-    conn = sqlite3.connect("dtl_data.db")
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO posts (user_id, content) VALUES (?, ?)", (user_id, content))
-    conn.commit()
-    conn.close()
+    st.subheader("Answers")
+    distribution = question_distribution(key)
+    st.bar_chart(distribution["count"])
+    st.dataframe(distribution.assign(share=distribution["share"].mul(100).round(1)).rename(columns={"share": "share (%)"}))
 
-def get_comments(post_id):
-    conn = sqlite3.connect("dtl_data.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT comments.id, comments.post_id, comments.user_id, comments.content, comments.created_at,
-               comments.parent_comment_id, users.name
-        FROM comments
-        JOIN users ON comments.user_id = users.id
-        WHERE comments.post_id = ?
-        ORDER BY comments.created_at ASC
-    """, (post_id,))
-    comments = cursor.fetchall()
-    conn.close()
-    return comments
+    st.subheader("Breakdown")
+    dimensions = {label: dimension for dimension, label in BREAKDOWN_DIMENSIONS}
+    dimension = dimensions[st.selectbox("By", list(dimensions), key="analytics_dimension")]
+    st.caption("Share of each group's answers (%)")
+    st.dataframe(question_crosstab(key, dimension).mul(100).round(1))
+
+    st.subheader("Trend")
+    period = st.selectbox("Per", list(TREND_PERIODS), index=1, key="analytics_period")
+    st.caption("Answers by when respondents signed up")
+    st.line_chart(question_trend(key, TREND_PERIODS[period]))
+
+@st.fragment
+def metrics_dashboard():
+    if st.button("Refresh", key="metrics_refresh"):
+        rerun_fragment()
+    calls, slow = get_metrics().snapshot()
+
+    st.subheader("Calls")
+    if calls:
+        rows = []
+        for (kind, name), stats in sorted(calls.items()):
+            rows.append({
+                "kind": kind,
+                "name": name,
+                "calls": stats["count"],
+                "errors": stats["errors"],
+                "avg ms": round(1000 * stats["seconds"] / stats["count"], 2),
+                "p50 ms": round(1000 * latency_quantile(stats, 0.5), 2),
+                "p95 ms": round(1000 * latency_quantile(stats, 0.95), 2),
+                "p99 ms": round(1000 * latency_quantile(stats, 0.99), 2),
+                "max ms": round(1000 * stats["max_seconds"], 2),
+                **stats["totals"],
+            })
+        st.dataframe(pd.DataFrame(rows), hide_index=True)
+        st.caption("Percentiles are histogram bucket upper bounds.")
+    else:
+        st.write("No calls recorded yet.")
+
+    st.subheader("Slow calls")
+    st.caption("Thresholds: " + ", ".join(
+        f"{kind} {threshold:g} ms" for kind, threshold in get_metrics().slow_thresholds.items()
+    ))
+    if slow:
+        st.dataframe(pd.DataFrame(slow[::-1]), hide_index=True)
+    else:
+        st.write("No slow calls.")
+
+    st.subheader("LLM backends")
+    backends = llm_backend_metrics(calls)
+    if backends:
+        st.dataframe(pd.DataFrame([
+            {
+                "backend": name,
+                "calls": figures["calls"],
+                "errors": figures["errors"],
+                "avg latency s": round(figures["avg_latency"], 3),
+                "avg first token s": round(figures["avg_time_to_first_token"], 3),
+                "tokens/s": round(figures["tokens_per_second"], 1),
+            }
+            for name, figures in backends.items()
+        ]), hide_index=True)
+        st.caption("Tokens are estimated at four characters each.")
+    else:
+        st.write("No LLM calls yet.")
+
+    st.subheader("Regulation jobs")
+    jobs = regulation_job_metrics()
+    for column, status in zip(st.columns(len(JOB_STATUSES)), JOB_STATUSES):
+        column.metric(status.capitalize(), jobs[status])
+    st.dataframe(pd.DataFrame(
+        {"p50 s": [jobs[f"{stage}_p50"] for stage in JOB_STAGES],
+         "p95 s": [jobs[f"{stage}_p95"] for stage in JOB_STAGES]},
+        index=JOB_STAGES,
+    ))
+    st.caption("Time queued (wait), generating (run) and in total, over the last 100 finished jobs.")
+
+    st.subheader("Query plans")
+    scans = get_hot_query_scans()
+    if scans:
+        st.warning("Hot queries that scan a whole table: " + "; ".join(
+            f"{name}: {detail}" for name, detail in scans
+        ))
+    else:
+        st.write("All hot queries use indexes.")
+    st.caption("Checked with EXPLAIN QUERY PLAN when the process opened the database.")
+
+    st.subheader("Read cache")
+    st.json(read_cache_stats())
+
+    with st.expander("Prometheus metrics"):
+        text = metrics_text()
+        st.code(text, language=None)
+        st.download_button("Download", text, file_name="metrics.txt", mime="text/plain")
+
+# Once-per-process startup: schema, question catalog, secrets and config.
+# After the first run, each rerun only pays for one cache lookup.
+@st.cache_resource
+def _bootstrap(db_path):
+    _init_db_once(db_path)
+    _load_question_catalog(db_path)
+    # Optional endpoint for Prometheus to scrape
+    metrics_port = get_setting("metrics_port")
+    if metrics_port:
+        start_metrics_server(int(metrics_port), get_setting("metrics_host", "127.0.0.1"))
+    return {
+        "db_path": db_path,
+        "api_key": get_api_key(),
+        "llm_backend": get_llm_backend_name(),
+    }
+
+def bootstrap():
+    """
+    Return the process configuration, setting up the process on first use.
+    """
+    return _bootstrap(get_db_path())
+
+PAGES = ["Home", "User Details", "Questionnaire", "Forum", "Regulation Generator", "Analytics", "Download Data", "Metrics"]
 
 # Main Streamlit Application
 def main():
-    questions=[]
     # Page configuration
     st.set_page_config(page_title="Autonomous Vehicles Ethics App", page_icon="🚗")
 
-    # Get API Key
-    api_key = get_api_key()
-    
-    if not api_key:
+    # Config, API key and database, set up once per process
+    config = bootstrap()
+
+    # Only the Gemini backend needs an API key
+    api_key = config["api_key"]
+    if not api_key and config["llm_backend"] == "gemini":
         st.error("Please provide a valid Gemini API Key")
+        # Look for the key again on the next run
+        _bootstrap.clear()
         return
 
-    # Initialize database
-    init_db()
-
     # Navigation
     st.sidebar.title("Navigation")
-    page = st.sidebar.selectbox("Go to", ["Home", "User Details", "Questionnaire", "Forum", "Regulation Generator", "Download Data"])
+    page = st.sidebar.selectbox("Go to", PAGES)
 
     # Home Page
     if page == "Home":
@@ -326,40 +3132,9 @@ def main():
     elif page == "Questionnaire":
         st.title("Ethical Questionnaire")
 
-        questions = [
-            {
-                "question": "Should autonomous vehicles prioritize saving passengers over pedestrians, or should every life be treated equally?",
-                "input_type": "selectbox",
-                "options": ["Prioritize Passengers", "Treat Every Life Equally", "Prioritize Pedestrians"]
-            },
-            {
-                "question": "In a situation where only one life can be saved, should age (e.g., child vs. elderly) influence the decision?",
-                "input_type": "selectbox",
-                "options": ["Yes, prioritize the younger", "No, every life is equal", "Not Sure"]
-            },
-            {
-                "question": "How should autonomous vehicles handle situations involving animals on the road? Should they prioritize human safety over animal lives?",
-                "input_type": "text_area"
-            },
-            {
-                "question": "Would you feel comfortable knowing an autonomous vehicle might sacrifice your safety to save a larger group of people?",
-                "input_type": "radio",
-                "options": ["Yes", "No", "Maybe"]
-            },
-            {
-                "question": "What ethical principles should guide the decisions of autonomous vehicles during accidents?",
-                "input_type": "text_area"
-            },
-            {
-                "question": "Should autonomous vehicles be programmed to follow traffic rules strictly, even if it means a higher risk of accidents?",
-                "input_type": "radio",
-                "options": ["Yes", "No", "Depends on the situation"]
-            },
-        ]
-
         responses = {}
 
-        for idx, item in enumerate(questions, 1):
+        for idx, item in enumerate(QUESTIONS, 1):
             st.write(f"**{idx}. {item['question']}**")
             if item["input_type"] == "radio":
                 responses[f"Q{idx}"] = st.radio("", item["options"], key=f"q{idx}")
@@ -384,143 +3159,74 @@ def main():
         st.title("Community Forum")
         st.subheader("Interact with other users!")
 
-        if 'user_id' in st.session_state:
-            st.write("### Create a New Post")
-            new_post = st.text_area("What's on your mind?", key="new_post")
-            if st.button("Post", key="post_button"):
-                if new_post.strip():
-                    insert_post(st.session_state['user_id'], new_post.strip())
-                    st.success("Post created!")
-                    st.experimental_rerun()  # Refresh the page to show the new post
-                else:
-                    st.error("Post content cannot be empty.")
-        else:
-            st.warning("Please submit your details on the User Details page to post.")
-
+        forum_search()
         st.write("---")
-        st.write("### Recent Posts")
-        posts = get_posts()
-        if posts:
-            for post in posts:
-                post_id, author_name, post_content, post_created_at = post
-                st.markdown(f"**{author_name}** posted at {post_created_at}")
-                st.write(post_content)
-
-                # Display comments
-                comments = get_comments(post_id)
-
-                # Function to display comments recursively
-                def display_comments(comments_list, parent_id=None, level=0):
-                    for comment in comments_list:
-                        comment_id = comment[0]
-                        comment_post_id = comment[1]
-                        comment_user_id = comment[2]
-                        comment_content = comment[3]
-                        comment_created_at = comment[4]
-                        comment_parent_id = comment[5]
-                        commenter_name = comment[6]
-
-                        if comment_parent_id == parent_id:
-                            indent = "&nbsp;" * 4 * level
-                            st.markdown(f"{indent}**{commenter_name}** replied at {comment_created_at}")
-                            st.markdown(f"{indent}{comment_content}")
-
-                            # Reply to comment
-                            if 'user_id' in st.session_state:
-                                with st.expander(f"{indent}Reply", expanded=False):
-                                    reply_content = st.text_area(f"Reply to {commenter_name}", key=f"reply_{comment_id}")
-                                    if st.button(f"Submit Reply to Comment {comment_id}", key=f"submit_reply_{comment_id}"):
-                                        if reply_content.strip():
-                                            insert_comment(post_id, st.session_state['user_id'], reply_content.strip(), parent_comment_id=comment_id)
-                                            st.success("Reply added!")
-                                            st.experimental_rerun()  # Refresh to show the new reply
-                                        else:
-                                            st.error("Reply cannot be empty.")
-                            # Recursive call to display nested comments
-                            display_comments(comments_list, parent_id=comment_id, level=level+1)
-
-                display_comments(comments)
-
-                # Add a comment to the post
-                if 'user_id' in st.session_state:
-                    st.write("**Add a comment:**")
-                    comment_content = st.text_input(f"Your comment on post {post_id}", key=f"comment_{post_id}")
-                    if st.button(f"Submit Comment to Post {post_id}", key=f"submit_comment_{post_id}"):
-                        if comment_content.strip():
-                            insert_comment(post_id, st.session_state['user_id'], comment_content.strip())
-                            st.success("Comment added!")
-                            st.experimental_rerun()  # Refresh to show the new comment
-                        else:
-                            st.error("Comment cannot be empty.")
-                else:
-                    st.warning("Please submit your details to comment.")
-
-                st.write("---")
-        else:
-            st.write("No posts yet. Be the first to post!")
+        forum_post_list()
 
     # Regulation Generator Page
     elif page == "Regulation Generator":
         st.title("Ethical Guidelines for Autonomous Vehicles")
         
-        # Fetch users and responses
-        conn = sqlite3.connect("dtl_data.db")
-        cursor = conn.cursor()
-        
-        # Fetch users
-        cursor.execute("SELECT * FROM users")
-        users = cursor.fetchall()
-        
-        # Fetch responses with questions
-        cursor.execute("""
-            SELECT r.user_id, 
-                   CASE 
-                     WHEN r.question LIKE '%prioritize%' THEN 'Should autonomous vehicles prioritize saving passengers over pedestrians?'
-                     WHEN r.question LIKE '%age%' THEN 'How should age influence life-saving decisions?'
-                     WHEN r.question LIKE '%animals%' THEN 'Handling situations involving animals on the road'
-                     WHEN r.question LIKE '%sacrifice%' THEN 'Comfort with potential self-sacrifice for group safety'
-                   END AS normalized_question, 
-                   r.response 
-            FROM responses r
-        """)
-        responses = cursor.fetchall()
-        conn.close()
-        
-        # Check if there are enough responses
-        if users and responses:
-            # Button to generate regulations
-            if st.button("Generate Ethical Guidelines"):
-                with st.spinner("Generating comprehensive guidelines..."):
-                    regulation = generate_regulation(users, responses, api_key)
-                    
-                    if regulation:
-                        st.success("Guidelines Generated Successfully!")
-                        st.markdown("### Generated Ethical Guidelines")
-                        st.write(regulation)
-                        
-                        # Option to save to file
-                        if st.button("Save Guidelines to File"):
-                            with open("autonomous_vehicle_ethics_guidelines.txt", "w") as f:
-                                f.write(regulation)
-                            st.success("Guidelines saved to 'autonomous_vehicle_ethics_guidelines.txt'")
-                    else:
-                        st.error("Failed to generate guidelines.")
-        else:
-            st.warning("Insufficient data to generate regulations.")
+        regulation_panel()
 
-        # Display recent stored regulations
-        st.subheader("Previous Generated Guidelines")
-        conn = sqlite3.connect("dtl_data.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT content, created_at FROM regulations ORDER BY created_at DESC LIMIT 3")
-        previous_regulations = cursor.fetchall()
-        conn.close()
-        
-        for regulation, timestamp in previous_regulations:
-            with st.expander(f"Guidelines - {timestamp}"):
-                st.write(regulation)
+    # Analytics Page
+    elif page == "Analytics":
+        st.title("Questionnaire Analytics")
+
+        analytics_dashboard()
+
+    # Download Data Page
+    elif page == "Download Data":
+        st.title("Download Data")
+        st.write("Export the collected data. Leave the filters empty for a full export.")
 
-    # Rest of the pages (Forum, Download Data) remain the same
+        table = st.selectbox("Table", EXPORT_CHOICES)
+        fmt = st.selectbox("Format", ["jsonl"] if table == COMMENT_THREADS_EXPORT else EXPORT_FORMATS)
+        since_id = st.number_input("Only rows with id greater than", min_value=0, step=1, key="export_since_id")
+        since = None
+        if export_timestamp_column(table):
+            since = st.date_input("Only rows created on or after", value=None, key="export_since")
+
+        if st.button("Prepare Export"):
+            # Written to a temporary file chunk by chunk rather than built in memory
+            try:
+                path, exported, last_id = prepare_export_file(table, fmt, since_id=since_id, since=since)
+            except (RuntimeError, ValueError) as e:
+                st.error(str(e))
+            else:
+                previous = st.session_state.get('export_file')
+                if previous and os.path.exists(previous[0]):
+                    os.unlink(previous[0])
+                st.session_state['export_file'] = (path, f"{table}.{fmt}", exported, last_id)
+
+        if st.session_state.get('export_file'):
+            path, file_name, exported, last_id = st.session_state['export_file']
+            if not os.path.exists(path):
+                del st.session_state['export_file']
+                st.warning("That export has expired; please prepare it again.")
+            else:
+                st.success(f"{exported} rows exported.")
+                if last_id:
+                    st.caption(f"For the next incremental export, use id greater than {last_id}.")
+                # Read only when clicked, not on every rerun. Streamlit still serves the
+                # file from memory, so very large tables are better exported with
+                # scripts/export_data.py.
+                st.download_button("Download", functools.partial(read_export_file, path), file_name=file_name)
+                st.caption(f"Prepared exports are deleted after {EXPORT_FILE_MAX_AGE_SECONDS // 60} minutes.")
+
+    # Metrics Page; disabled until the admin_password secret is set
+    elif page == "Metrics":
+        st.title("Metrics")
+
+        admin_password = get_setting("admin_password")
+        if not admin_password:
+            st.warning("The metrics page is disabled. Set the admin_password secret to enable it.")
+        else:
+            password = st.text_input("Admin password", type="password", key="admin_password")
+            if hmac.compare_digest(password.encode(), str(admin_password).encode()):
+                metrics_dashboard()
+            else:
+                st.warning("Enter the admin password to view the metrics.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,210 @@
+"""
+Latency and memory benchmarks for the data-access paths, at several data sizes.
+
+For each scale a fresh database is filled by synthetic_data.generate(), then every
+benchmark runs --repeat times (after a short warm-up) with the read cache bypassed.
+LLM calls go to the offline fake backend (DTL_LLM_BACKEND=fake).
+Reports p50/p95/p99 latency and the peak memory allocated by one call (tracemalloc),
+and writes everything to a JSON file. Pass an earlier results file as --compare to
+flag benchmarks whose p95 latency or memory grew by more than --threshold.
+
+    python benchmarks/bench_data_access.py --scales 1000,10000 --output before.json
+    python benchmarks/bench_data_access.py --scales 1000,10000 --output after.json --compare before.json
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_api  # noqa: E402
+import synthetic_data  # noqa: E402
+
+WARMUP_RUNS = 3
+# Differences smaller than this are noise, whatever the ratio
+MIN_REGRESSION_MS = 0.05
+MIN_REGRESSION_KIB = 16
+
+
+def uncached(func):
+    # Measure the query itself rather than a read-cache hit
+    return getattr(func, "__wrapped__", func)
+
+
+def prepare(users):
+    """
+    Return {name: callable} for the benchmarks against the current database.
+    """
+    page_size = app_api.get_forum_page_size()
+    newest = uncached(app_api.get_posts)(page_size)
+    page_ids = [post[0] for post in newest]
+    with app_api.connection() as conn:
+        middle = conn.execute(
+            "SELECT created_at, id FROM posts ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?",
+            (conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0] // 2,)
+        ).fetchone()
+        # synthetic_data puts the long reply chains on the first posts it creates
+        deep_post = conn.execute("""
+            SELECT post_id FROM comments GROUP BY post_id ORDER BY COUNT(*) DESC LIMIT 1
+        """).fetchone()[0]
+    deep_comments = uncached(app_api.get_comments)(deep_post)
+    answers = {
+        f"Q{idx}": item["options"][0] if "options" in item else "Safety first, then transparency."
+        for idx, item in enumerate(app_api.QUESTIONS, 1)
+    }
+    submitters = iter(range(1, users + 1))
+
+    def regulation_prompt():
+        return app_api.build_regulation_prompt(
+            uncached(app_api.get_response_stats)(),
+            uncached(app_api.get_response_samples)(),
+            app_api.get_response_summaries(),
+        )
+
+    def regulation_job():
+        # The whole path the Regulation Generator page triggers: queue a job, let the
+        # worker summarize every free-text answer from scratch (map, then reduce) and
+        # stream the final answer, with the offline fake LLM backend
+        with app_api.connection() as conn, conn:
+            conn.execute("DELETE FROM response_summaries")
+        job_id = app_api.submit_regulation_job(None, force=True)
+        while True:
+            job = app_api.get_regulation_job(job_id)
+            if job["status"] == "failed":
+                raise RuntimeError(job["error"])
+            if job["status"] == "done":
+                return job
+            time.sleep(0.001)
+
+    def render_comment_tree():
+        return list(app_api.walk_comment_tree(app_api.build_comment_tree(deep_comments)))
+
+    return {
+        "get_posts": lambda: uncached(app_api.get_posts)(page_size),
+        "get_posts_before": lambda: uncached(app_api.get_posts)(page_size, tuple(middle)),
+        "get_comments_deep_thread": lambda: uncached(app_api.get_comments)(deep_post),
+        "get_comments_for_posts": lambda: uncached(app_api.get_comments_for_posts)(page_ids),
+        "render_comment_tree": render_comment_tree,
+        "search_forum": lambda: uncached(app_api.search_forum)("pedestrian safety", page_size),
+        "insert_responses": lambda: app_api.insert_responses(next(submitters), answers),
+        "regulation_prompt": regulation_prompt,
+        "regulation_job": regulation_job,
+        "analytics_crosstab": lambda: app_api.question_crosstab("Q1", "age_band"),
+    }
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile
+    return sorted_values[max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)]
+
+
+def measure(func, repeat):
+    for _ in range(WARMUP_RUNS):
+        func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    # Memory is measured on a separate call so tracing doesn't skew the timings
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    timings.sort()
+    return {
+        "runs": repeat,
+        "p50_ms": percentile(timings, 50),
+        "p95_ms": percentile(timings, 95),
+        "p99_ms": percentile(timings, 99),
+        "mean_ms": sum(timings) / repeat,
+        "peak_kib": peak / 1024,
+    }
+
+
+def run_scale(users, repeat, seed, only=None):
+    os.environ["DTL_DB_PATH"] = os.path.join(tempfile.mkdtemp(), f"bench_{users}.db")
+    os.environ["DTL_WRITE_QUEUE"] = "0"
+    os.environ["DTL_LLM_BACKEND"] = "fake"
+    loaded_at = time.perf_counter()
+    counts = synthetic_data.generate(users, seed=seed)
+    load_seconds = time.perf_counter() - loaded_at
+    results = {}
+    for name, func in prepare(users).items():
+        if only and name not in only:
+            continue
+        results[name] = measure(func, repeat)
+        print(f"{users:>8} users  {name:<26} p50 {results[name]['p50_ms']:8.2f}ms  "
+              f"p95 {results[name]['p95_ms']:8.2f}ms  p99 {results[name]['p99_ms']:8.2f}ms  "
+              f"peak {results[name]['peak_kib']:9.1f}KiB")
+    return {"rows": counts, "load_seconds": load_seconds, "benchmarks": results}
+
+
+def compare(current, baseline, threshold):
+    """
+    Return (scale, name, metric, old, new) for every benchmark that got worse by more
+    than `threshold` (a fraction) in p95 latency or peak memory.
+    """
+    regressions = []
+    for scale, result in current["scales"].items():
+        old_benchmarks = baseline["scales"].get(scale, {}).get("benchmarks", {})
+        for name, new in result["benchmarks"].items():
+            old = old_benchmarks.get(name)
+            if old is None:
+                continue
+            for metric, floor in (("p95_ms", MIN_REGRESSION_MS), ("peak_kib", MIN_REGRESSION_KIB)):
+                if new[metric] > old[metric] * (1 + threshold) and new[metric] - old[metric] > floor:
+                    regressions.append((scale, name, metric, old[metric], new[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="1000,10000,50000", help="comma-separated user counts")
+    parser.add_argument("--repeat", type=int, default=50, help="timed runs per benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", help="comma-separated benchmark names to run")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed growth, e.g. 0.25 for 25%%")
+    args = parser.parse_args()
+
+    only = set(args.only.split(",")) if args.only else None
+    results = {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "scales": {},
+    }
+    for users in (int(scale) for scale in args.scales.split(",")):
+        results["scales"][str(users)] = run_scale(users, args.repeat, args.seed, only)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for scale, name, metric, old, new in regressions:
+            print(f"REGRESSION {scale} users {name} {metric}: {old:.2f} -> {new:.2f} ({new / old - 1:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Time to first render and per-rerun cost of every page, measured with Streamlit's AppTest.
+
+Each sample runs in a fresh Python process, so module imports and the process bootstrap
+are paid again. It renders the Home page (time to first render), then opens each page
+once (first visit) and reruns it --reruns times (steady-state cost of a rerun). Medians
+across --samples processes are reported, with the heavy modules the Home page imported.
+
+AppTest recompiles the script on every run, which the Streamlit server doesn't (it keeps
+the bytecode), so the compiled script is reused here too and the compile is reported on
+its own. "script" is the time spent executing the script body itself, timed around
+Streamlit's script execution; "rerun" adds AppTest's own overhead on top.
+
+    python benchmarks/bench_startup.py --samples 5 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app_api.py")
+HEAVY_MODULES = ["pandas", "numpy", "requests", "pyarrow"]
+
+
+def instrument_script_runs():
+    """
+    Make AppTest compile the script once per process, as the server does, and time each
+    execution of the script body. Returns the list the timings (ms) are appended to.
+    """
+    from streamlit.runtime.scriptrunner import script_runner
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    bytecode = {}
+    get_bytecode = ScriptCache.get_bytecode
+
+    def cached_get_bytecode(self, script_path):
+        if script_path not in bytecode:
+            bytecode[script_path] = get_bytecode(self, script_path)
+        return bytecode[script_path]
+
+    script_timings = []
+    exec_func = script_runner.exec_func_with_error_handling
+
+    def timed_exec_func(func, ctx):
+        started = time.perf_counter()
+        try:
+            return exec_func(func, ctx)
+        finally:
+            script_timings.append((time.perf_counter() - started) * 1000)
+
+    ScriptCache.get_bytecode = cached_get_bytecode
+    script_runner.exec_func_with_error_handling = timed_exec_func
+    return script_timings
+
+
+def sample(reruns):
+    """
+    Run one cold-start sample in this process and return its timings.
+    """
+    # Streamlit itself is not part of the app's startup cost
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import AppTest
+
+    compile_timings = []
+    for _ in range(3):
+        started = time.perf_counter()
+        ScriptCache().get_bytecode(APP_PATH)
+        compile_timings.append((time.perf_counter() - started) * 1000)
+    script_timings = instrument_script_runs()
+
+    started = time.perf_counter()
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.run()
+    result = {
+        "first_render_ms": (time.perf_counter() - started) * 1000,
+        "heavy_modules_after_home": [name for name in HEAVY_MODULES if name in sys.modules],
+        "compile_ms": statistics.median(compile_timings),
+        "pages": {},
+    }
+    for page in at.sidebar.selectbox[0].options:
+        started = time.perf_counter()
+        at.sidebar.selectbox[0].select(page).run()
+        first_visit = (time.perf_counter() - started) * 1000
+        timings, script = [], []
+        for _ in range(reruns):
+            del script_timings[:]
+            started = time.perf_counter()
+            at.run()
+            timings.append((time.perf_counter() - started) * 1000)
+            # A run that requests a rerun executes the script more than once
+            script.append(sum(script_timings))
+        result["pages"][page] = {
+            "first_visit_ms": first_visit,
+            "rerun_ms": statistics.median(timings) if timings else None,
+            "script_ms": statistics.median(script) if script else None,
+            "errors": [str(exception.value) for exception in at.exception],
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=5, help="cold-start processes to run")
+    parser.add_argument("--reruns", type=int, default=10, help="timed reruns per page")
+    parser.add_argument("--users", type=int, default=1000, help="synthetic respondents to load first")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(sample(args.reruns)))
+        return
+
+    env = dict(os.environ, DTL_DB_PATH=os.path.join(tempfile.mkdtemp(), "startup.db"), DTL_LLM_BACKEND="fake")
+    os.environ.update(env)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import synthetic_data
+    synthetic_data.generate(args.users)
+
+    samples = []
+    for _ in range(args.samples):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", "--reruns", str(args.reruns)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    pages = samples[0]["pages"]
+    results = {
+        "samples": args.samples,
+        "reruns": args.reruns,
+        "users": args.users,
+        "first_render_ms": statistics.median(s["first_render_ms"] for s in samples),
+        "compile_ms": statistics.median(s["compile_ms"] for s in samples),
+        "heavy_modules_after_home": samples[0]["heavy_modules_after_home"],
+        "pages": {
+            page: {
+                "first_visit_ms": statistics.median(s["pages"][page]["first_visit_ms"] for s in samples),
+                "rerun_ms": statistics.median(s["pages"][page]["rerun_ms"] for s in samples),
+                "script_ms": statistics.median(s["pages"][page]["script_ms"] for s in samples),
+                "errors": sorted({error for s in samples for error in s["pages"][page]["errors"]}),
+            }
+            for page in pages
+        },
+    }
+
+    print(f"Time to first render (Home): {results['first_render_ms']:.0f}ms")
+    print(f"Heavy modules imported by then: {', '.join(results['heavy_modules_after_home']) or 'none'}")
+    print(f"Script compile (paid once per process): {results['compile_ms']:.0f}ms")
+    for page, timings in results["pages"].items():
+        errors = f"  ERRORS: {'; '.join(timings['errors'])}" if timings["errors"] else ""
+        print(f"  {page:<22} first visit {timings['first_visit_ms']:7.0f}ms  "
+              f"rerun {timings['rerun_ms']:7.1f}ms  script {timings['script_ms']:7.1f}ms{errors}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
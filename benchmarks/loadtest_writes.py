@@ -0,0 +1,86 @@
+"""
+Survey-burst load test for the questionnaire and forum inserts.
+
+Many threads submit user details, questionnaire answers and a forum post at once,
+first with the write queue disabled (every call commits on its own connection) and
+then through the single-writer group-commit queue. Reports writes per second and
+failed writes for each mode.
+
+The queue only pays off under real concurrency: on a laptop-class machine 100 and 50
+submitters go from roughly 850 and 1150 writes/s direct to 2000-3000 queued, 20
+submitters from about 1200-1800 to 2000-2300, while 5 submitters are even and a single
+one is 10-25% slower through the queue. Numbers vary run to run; compare the two modes
+within one run.
+
+    python benchmarks/loadtest_writes.py --threads 30 --submissions 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_api  # noqa: E402
+
+ANSWERS = {
+    "Q1": "Treat Every Life Equally",
+    "Q2": "No, every life is equal",
+    "Q3": "Human safety first, but brake for animals when it is safe to do so.",
+    "Q4": "Maybe",
+    "Q5": "Minimize total harm and be transparent about how decisions are made.",
+    "Q6": "Depends on the situation",
+}
+
+
+def submit(worker, count, failures):
+    for i in range(count):
+        try:
+            user_id = app_api.insert_user(f"load-{worker}-{i}", 20 + i % 50, "Other", "Yes")
+            app_api.insert_responses(user_id, ANSWERS)
+            app_api.insert_post(user_id, f"Post {i} from worker {worker}")
+        except Exception as e:
+            failures.append(e)
+
+
+def run(mode, threads, submissions):
+    db_path = os.path.join(tempfile.mkdtemp(), "loadtest.db")
+    os.environ["DTL_DB_PATH"] = db_path
+    os.environ["DTL_WRITE_QUEUE"] = "1" if mode == "queued" else "0"
+    app_api.init_db()
+
+    failures = []
+    workers = [
+        threading.Thread(target=submit, args=(worker, submissions, failures))
+        for worker in range(threads)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    # Each submission is three write calls: user, answers, post
+    writes = threads * submissions * 3 - len(failures)
+    return {"mode": mode, "writes": writes, "failed": len(failures), "seconds": elapsed, "writes_per_second": writes / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=30, help="concurrent submitters")
+    parser.add_argument("--submissions", type=int, default=20, help="submissions per submitter")
+    args = parser.parse_args()
+
+    for mode in ("direct", "queued"):
+        result = run(mode, args.threads, args.submissions)
+        print(
+            f"{result['mode']:>7}: {result['writes']} writes in {result['seconds']:.2f}s "
+            f"= {result['writes_per_second']:.0f} writes/s, {result['failed']} failed"
+        )
+
+
+if __name__ == "__main__":
+    main()
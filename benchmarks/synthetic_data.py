@@ -0,0 +1,132 @@
+"""
+Seeded synthetic data for benchmarks and local testing.
+
+Bulk-loads users with questionnaire answers, forum posts and comment trees (some of
+them deep reply chains) into the database named by DTL_DB_PATH (or --db), then
+rebuilds the response aggregates. The same seed always produces the same data.
+
+    python benchmarks/synthetic_data.py --db /tmp/dtl_10k.db --users 10000
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_api  # noqa: E402
+
+GENDERS = ["Male", "Female", "Other"]
+WORDS = (
+    "autonomous vehicle safety pedestrian passenger ethics brake swerve risk harm "
+    "transparency accountability sensor law traffic child elderly animal road "
+    "decision algorithm fairness trust insurance liability emergency collision"
+).split()
+START = datetime.datetime(2024, 1, 1)
+BATCH_ROWS = 5000
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def timestamp(rng, days):
+    moment = START + datetime.timedelta(seconds=rng.randrange(days * 86400))
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _executemany(conn, sql, rows):
+    for start in range(0, len(rows), BATCH_ROWS):
+        conn.executemany(sql, rows[start:start + BATCH_ROWS])
+
+
+def generate(users, posts=None, comments_per_post=8, deep_threads=10, deep_depth=50, days=365, seed=0):
+    """
+    Load the synthetic data into the configured database in one transaction.
+    posts defaults to one per ten users. Returns the number of rows inserted per table.
+    """
+    rng = random.Random(seed)
+    posts = users // 10 if posts is None else posts
+    app_api.init_db()
+    catalog = app_api.get_question_catalog()
+
+    with app_api.connection() as conn, conn:
+        first_user = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0] + 1
+        user_ids = range(first_user, first_user + users)
+        _executemany(conn, """
+            INSERT INTO users (id, name, age, gender, knows_autonomous, timestamp) VALUES (?, ?, ?, ?, ?, ?)
+        """, [
+            (user_id, f"user{user_id}", rng.randint(16, 80), rng.choice(GENDERS),
+             rng.choice(["Yes", "No"]), timestamp(rng, days))
+            for user_id in user_ids
+        ])
+
+        responses = []
+        for user_id in user_ids:
+            for question_id, input_type, options in catalog.values():
+                if input_type == "text_area":
+                    responses.append((user_id, question_id, None, sentence(rng, rng.randint(5, 40))))
+                else:
+                    responses.append((user_id, question_id, rng.choice(list(options.values())), None))
+        _executemany(conn, """
+            INSERT INTO responses (user_id, question_id, option_id, response) VALUES (?, ?, ?, ?)
+        """, responses)
+
+        first_post = conn.execute("SELECT COALESCE(MAX(id), 0) FROM posts").fetchone()[0] + 1
+        post_ids = range(first_post, first_post + posts)
+        _executemany(conn, """
+            INSERT INTO posts (id, user_id, content, created_at) VALUES (?, ?, ?, ?)
+        """, [
+            (post_id, rng.choice(user_ids), sentence(rng, rng.randint(10, 80)), timestamp(rng, days))
+            for post_id in post_ids
+        ])
+
+        # Mostly shallow threads, plus a few long reply chains
+        comment_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM comments").fetchone()[0]
+        comments = []
+        for index, post_id in enumerate(post_ids):
+            thread = []
+            count = deep_depth if index < deep_threads else rng.randint(0, 2 * comments_per_post)
+            for position in range(count):
+                comment_id += 1
+                if index < deep_threads:
+                    parent = thread[-1] if thread else None
+                else:
+                    parent = rng.choice(thread) if thread and rng.random() < 0.6 else None
+                created_at = (START + datetime.timedelta(days=days, seconds=position)).strftime("%Y-%m-%d %H:%M:%S")
+                comments.append((comment_id, post_id, rng.choice(user_ids), parent,
+                                 sentence(rng, rng.randint(3, 30)), created_at))
+                thread.append(comment_id)
+        _executemany(conn, """
+            INSERT INTO comments (id, post_id, user_id, parent_comment_id, content, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, comments)
+
+        app_api.rebuild_response_aggregates(conn.cursor())
+    app_api.bump_data_version()
+    return {"users": users, "responses": len(responses), "posts": posts, "comments": len(comments)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="database to load into (default: DTL_DB_PATH or dtl_data.db)")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, help="default: one per ten users")
+    parser.add_argument("--comments-per-post", type=int, default=8, help="average for ordinary threads")
+    parser.add_argument("--deep-threads", type=int, default=10, help="posts with one long reply chain")
+    parser.add_argument("--deep-depth", type=int, default=50, help="comments in each long reply chain")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.db:
+        os.environ["DTL_DB_PATH"] = args.db
+    started = time.perf_counter()
+    counts = generate(args.users, args.posts, args.comments_per_post, args.deep_threads, args.deep_depth, seed=args.seed)
+    print(", ".join(f"{count} {table}" for table, count in counts.items()),
+          f"loaded in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
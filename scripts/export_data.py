@@ -0,0 +1,73 @@
+"""
+Export app tables for offline analysis, e.g. from a nightly job.
+
+    python scripts/export_data.py --format parquet --out-dir exports
+    python scripts/export_data.py --table responses --table users --format jsonl --since-id responses=1800 --since-id users=300
+    python scripts/export_data.py --format jsonl --out-dir exports --state exports/state.json
+    python scripts/export_data.py --table comment_threads --format jsonl
+
+Each table is exported after its own last id: pass the last id printed for a table as
+--since-id TABLE=ID next time, or keep them in a --state file, which is read before
+and updated after every run so each run exports only the new rows.
+
+Every run writes new files, named after the run's UTC start time
+(e.g. responses_20240101T020000Z.csv), so earlier deltas are never overwritten.
+The state file is only updated once all of them have been written.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_api  # noqa: E402
+
+
+def table_id(value):
+    table, sep, last_id = value.partition("=")
+    if not sep or table not in app_api.EXPORT_CHOICES or not last_id.isdigit():
+        raise argparse.ArgumentTypeError(f"expected TABLE=ID with TABLE one of {', '.join(app_api.EXPORT_CHOICES)}")
+    return table, int(last_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--table", choices=app_api.EXPORT_CHOICES, action="append",
+                        help=f"table to export (repeatable; default: all but {app_api.COMMENT_THREADS_EXPORT}, "
+                             "which posts are nested with their comment trees, as jsonl only)")
+    parser.add_argument("--format", choices=app_api.EXPORT_FORMATS, default="csv")
+    parser.add_argument("--out-dir", default=".")
+    parser.add_argument("--since-id", type=table_id, action="append", default=[], metavar="TABLE=ID",
+                        help="only rows of TABLE with a greater id (repeatable)")
+    parser.add_argument("--state", help="JSON file of the last exported id per table, read and updated")
+    parser.add_argument("--since", help="only rows created at or after this timestamp (YYYY-MM-DD[ HH:MM:SS])")
+    args = parser.parse_args()
+
+    since_ids = {}
+    if args.state and os.path.exists(args.state):
+        with open(args.state) as f:
+            since_ids.update(json.load(f))
+    since_ids.update(args.since_id)
+
+    app_api.init_db()
+    os.makedirs(args.out_dir, exist_ok=True)
+    run = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    for table in args.table or list(app_api.EXPORT_TABLES):
+        since = args.since if app_api.export_timestamp_column(table) else None
+        path = os.path.join(args.out_dir, f"{table}_{run}.{args.format}")
+        exported, last_id = app_api.export_table(
+            table, args.format, path, since_id=since_ids.get(table), since=since
+        )
+        if last_id is not None:
+            since_ids[table] = last_id
+        print(f"{table}: {exported} rows -> {path} (last id {last_id})")
+
+    if args.state:
+        with open(args.state, "w") as f:
+            json.dump(since_ids, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
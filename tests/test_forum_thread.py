@@ -0,0 +1,51 @@
+"""
+The forum_thread fragment against a seeded database, through Streamlit's AppTest.
+"""
+import os
+import sys
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import synthetic_data  # noqa: E402
+
+
+def stale_thread_app():
+    # AppTest always reruns the whole script, so replay the arguments captured on the
+    # first run, as Streamlit does when it reruns only the fragment
+    import streamlit as st
+
+    import app_api
+
+    if "captured" not in st.session_state:
+        posts, _ = app_api.get_forum(20)
+        post = next(post for post, _ in posts if post[4] >= 2)
+        st.session_state["captured"] = (post, app_api.get_comments(post[0]))
+        st.session_state[f"show_thread_{post[0]}"] = True
+    post, comments = st.session_state["captured"]
+    app_api.forum_thread(post, comments)
+
+
+def test_thread_keeps_new_replies_across_fragment_reruns(tmp_path, monkeypatch):
+    monkeypatch.setenv("DTL_DB_PATH", str(tmp_path / "forum.db"))
+    synthetic_data.generate(200, deep_threads=0)
+
+    at = AppTest.from_function(stale_thread_app, default_timeout=60)
+    at.session_state["user_id"] = 1
+    at.run()
+    comments = sum("replied at" in markdown.value for markdown in at.markdown)
+    first, second = [button.key for button in at.button if button.key.startswith("reply_button_")][:2]
+
+    at.button(key=first).click().run()
+    comment_id = first.rsplit("_", 1)[1]
+    at.text_area(key=f"reply_{comment_id}").input("A new reply").run()
+    at.button(key=f"submit_reply_{comment_id}").click().run()
+    # Any later rerun of the thread, e.g. opening another reply box, still shows it
+    at.button(key=second).click().run()
+
+    assert not at.exception
+    assert sum("replied at" in markdown.value for markdown in at.markdown) == comments + 1
+    assert at.toggle[0].label == f"Show comments ({comments + 1})"
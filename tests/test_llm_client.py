@@ -0,0 +1,215 @@
+"""
+LLMClient and the HTTP backends against a local mock LLM server.
+"""
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_api  # noqa: E402
+
+
+class MockLLMServer(http.server.ThreadingHTTPServer):
+    """
+    Answers each POST with the next scripted action, or `default` once they run out.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), MockLLMHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.actions = []
+        self.default = reply_json({"ok": True})
+        self.requests = []
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+class MockLLMHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers), body))
+            action = server.actions.pop(0) if server.actions else server.default
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            action(self)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting
+            pass
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+def reply_json(body, status=200, headers=None, delay=0.0):
+    def action(handler):
+        time.sleep(delay)
+        data = json.dumps(body).encode()
+        handler.send_response(status)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+    return action
+
+
+def reply_sse(events):
+    def action(handler):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.end_headers()
+        for event in events:
+            data = event if isinstance(event, str) else json.dumps(event)
+            handler.wfile.write(f"data: {data}\n\n".encode())
+            handler.wfile.flush()
+    return action
+
+
+@pytest.fixture
+def server():
+    server = MockLLMServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(**kwargs):
+    settings = {"connect_timeout": 1.0, "read_timeout": 5.0, "max_retries": 3, "backoff_base": 0.01}
+    settings.update(kwargs)
+    return app_api.LLMClient(**settings)
+
+
+def test_retries_server_errors(server):
+    server.actions = [reply_json({}, status=503), reply_json({}, status=502), reply_json({"answer": 42})]
+    with make_client().post(server.url, {}, {"prompt": "hi"}) as response:
+        assert response.json() == {"answer": 42}
+    assert len(server.requests) == 3
+
+
+def test_gives_up_after_max_retries(server):
+    server.default = reply_json({}, status=503)
+    with pytest.raises(requests.exceptions.HTTPError):
+        with make_client(max_retries=2).post(server.url, {}, {}):
+            pass
+    assert len(server.requests) == 3
+
+
+def test_does_not_retry_client_errors(server):
+    server.default = reply_json({}, status=400)
+    with pytest.raises(requests.exceptions.HTTPError):
+        with make_client().post(server.url, {}, {}):
+            pass
+    assert len(server.requests) == 1
+
+
+def test_waits_for_retry_after(server):
+    server.actions = [reply_json({}, status=429, headers={"Retry-After": "1"}), reply_json({"ok": True})]
+    started = time.perf_counter()
+    with make_client().post(server.url, {}, {}) as response:
+        assert response.json() == {"ok": True}
+    assert time.perf_counter() - started >= 1.0
+    assert len(server.requests) == 2
+
+
+def test_fails_on_retry_after_beyond_the_backoff_ceiling(server):
+    server.default = reply_json({}, status=429, headers={"Retry-After": "3600"})
+    started = time.perf_counter()
+    with pytest.raises(requests.exceptions.HTTPError):
+        with make_client(backoff_max=2.0).post(server.url, {}, {}):
+            pass
+    assert time.perf_counter() - started < 1.0
+    assert len(server.requests) == 1
+
+
+def test_read_timeout_is_retried_then_raised(server):
+    server.default = reply_json({"late": True}, delay=1.0)
+    client = make_client(read_timeout=0.2, max_retries=1)
+    started = time.perf_counter()
+    with pytest.raises(requests.exceptions.Timeout):
+        with client.post(server.url, {}, {}):
+            pass
+    assert time.perf_counter() - started < 1.0
+    assert len(server.requests) == 2
+
+
+def test_caps_concurrent_requests(server):
+    server.default = reply_json({"ok": True}, delay=0.2)
+    client = make_client(max_concurrency=2)
+
+    def call():
+        with client.post(server.url, {}, {}) as response:
+            response.json()
+
+    threads = [threading.Thread(target=call) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(server.requests) == 6
+    assert server.max_in_flight == 2
+
+
+@pytest.mark.parametrize("url", ["ftp://example.invalid/v1", "not a url", "http://"])
+def test_request_errors_release_the_slot(url):
+    client = make_client(max_concurrency=2)
+    # One failed call per slot; if they leaked, nothing could be acquired below
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.RequestException):
+            with client.post(url, {}, {}):
+                pass
+    assert client._slots.acquire(timeout=1)
+    assert client._slots.acquire(timeout=1)
+
+
+def test_openai_compatible_backend_streams_tokens(server):
+    server.actions = [reply_sse([
+        {"choices": [{"delta": {"role": "assistant"}}]},
+        {"choices": [{"delta": {"content": "Safety "}}]},
+        {"choices": [{"delta": {"content": "first."}}]},
+        "[DONE]",
+    ])]
+    backend = app_api.OpenAICompatibleBackend(base_url=server.url + "/v1", model="llama3.1", client=make_client())
+    assert list(backend.stream("Write guidelines")) == ["Safety ", "first."]
+    path, _, body = server.requests[0]
+    assert path == "/v1/chat/completions"
+    assert body["stream"] is True
+    assert body["messages"] == [{"role": "user", "content": "Write guidelines"}]
+
+
+def test_gemini_backend_streams_tokens(server):
+    def event(text):
+        return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+    server.actions = [reply_sse([event("Be "), event("transparent.")])]
+    backend = app_api.GeminiBackend("test-key", url=server.url + "/models/gemini:generateContent", client=make_client())
+    assert list(backend.stream("Write guidelines")) == ["Be ", "transparent."]
+    path, headers, _ = server.requests[0]
+    assert path == "/models/gemini:streamGenerateContent?alt=sse"
+    assert headers["x-goog-api-key"] == "test-key"
+
+
+def test_generate_retries_then_returns_text(server):
+    server.actions = [
+        reply_json({}, status=500),
+        reply_json({"choices": [{"message": {"content": "Treat every life equally."}}]}),
+    ]
+    backend = app_api.OpenAICompatibleBackend(base_url=server.url + "/v1", client=make_client())
+    assert backend.generate("Write guidelines") == "Treat every life equally."
+    assert len(server.requests) == 2
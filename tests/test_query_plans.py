@@ -0,0 +1,41 @@
+"""
+Query plans of the hot queries, checked against seeded databases.
+"""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import app_api  # noqa: E402
+import synthetic_data  # noqa: E402
+
+
+def test_hot_queries_use_indexes(tmp_path, monkeypatch):
+    monkeypatch.setenv("DTL_DB_PATH", str(tmp_path / "seeded.db"))
+    synthetic_data.generate(2000)
+    with app_api.connection() as conn:
+        conn.execute("ANALYZE")
+        assert app_api.find_table_scans(conn) == []
+
+
+def test_table_scans_are_reported_not_raised(tmp_path, monkeypatch):
+    # One user and many posts: after ANALYZE the planner rightly scans the tiny users table
+    db_path = tmp_path / "skewed.db"
+    conn = sqlite3.connect(db_path)
+    app_api.migrate(conn)
+    conn.execute("INSERT INTO users (name) VALUES ('only')")
+    conn.executemany("INSERT INTO posts (user_id, content) VALUES (1, ?)", [(f"post {i}",) for i in range(5000)])
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+    monkeypatch.setenv("DTL_DB_PATH", str(db_path))
+    app_api.init_db()
+    scans = app_api.get_hot_query_scans()
+    assert ("forum_posts", "SCAN users") in scans
+    assert 'dtl_hot_query_table_scans{query="forum_posts"} 1' in app_api.metrics_text()
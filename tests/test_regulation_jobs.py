@@ -0,0 +1,80 @@
+"""
+Regulation jobs and free-text summaries against a seeded database, with the fake LLM backend.
+"""
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import app_api  # noqa: E402
+import synthetic_data  # noqa: E402
+
+
+def idle_worker():
+    # A worker without its thread, so the test decides when jobs are claimed and run
+    worker = object.__new__(app_api.RegulationWorker)
+    worker._lock = threading.Lock()
+    worker._partial = {}
+    return worker
+
+
+def seed(tmp_path, monkeypatch, users=200):
+    monkeypatch.setenv("DTL_DB_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.setenv("DTL_LLM_BACKEND", "fake")
+    synthetic_data.generate(users)
+
+
+def test_only_jobs_with_a_stale_heartbeat_are_requeued(tmp_path, monkeypatch):
+    seed(tmp_path, monkeypatch, users=10)
+    now = time.time()
+    long_ago = now - 2 * app_api.JOB_STALE_SECONDS
+    with app_api.connection() as conn, conn:
+        conn.executemany("""
+            INSERT INTO regulation_jobs (id, input_hash, status, created_at, started_at, heartbeat_at)
+            VALUES (?, 'x', 'running', ?, ?, ?)
+        """, [(1, long_ago, long_ago, now), (2, long_ago, long_ago, long_ago), (3, long_ago, long_ago, None)])
+
+    worker = idle_worker()
+    assert [worker._claim(), worker._claim(), worker._claim()] == [(2, 0), (3, 0), None]
+    with app_api.connection() as conn:
+        assert conn.execute("SELECT status FROM regulation_jobs WHERE id = 1").fetchone() == ("running",)
+
+
+def test_running_job_heartbeats_between_summaries(tmp_path, monkeypatch):
+    seed(tmp_path, monkeypatch)
+    monkeypatch.setattr(app_api, "JOB_HEARTBEAT_SECONDS", 0)
+    # Not submit_regulation_job, which would wake the real worker
+    with app_api.connection() as conn, conn:
+        job_id = conn.execute("""
+            INSERT INTO regulation_jobs (input_hash, status, created_at, started_at, heartbeat_at)
+            VALUES ('x', 'running', 0, 0, 0)
+        """).lastrowid
+    worker = idle_worker()
+    beats = []
+    heartbeat = worker._heartbeat
+    worker._heartbeat = lambda job_id: (beats.append(job_id), heartbeat(job_id))
+    worker._run_job(job_id, False)
+
+    job = app_api.get_regulation_job(job_id)
+    assert job["status"] == "done", job["error"]
+    with app_api.connection() as conn:
+        summaries = conn.execute("SELECT COUNT(*) FROM response_summaries").fetchone()[0]
+    assert summaries > 1
+    assert len(beats) >= summaries
+    with app_api.connection() as conn:
+        started_at, heartbeat_at = conn.execute(
+            "SELECT started_at, heartbeat_at FROM regulation_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    assert heartbeat_at > started_at
+
+
+def test_summaries_are_stored_once_per_range(tmp_path, monkeypatch):
+    seed(tmp_path, monkeypatch, users=10)
+    app_api._store_summary("Q3", 1, 9, 5, "first")
+    # e.g. a job requeued while its first run was still going
+    app_api._store_summary("Q3", 1, 9, 5, "second")
+    assert app_api.get_response_summaries() == {"Q3": (["first"], 5)}